@@ -1,24 +1,48 @@
 import os
+import hashlib
 import logging
 import json
+import math
 import re
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from types import MappingProxyType
+import click
 from dotenv import load_dotenv
-from flask import (Flask, Response, abort, jsonify, render_template, request,
-                   send_from_directory, url_for)
+from flask import (Flask, Response, abort, render_template, request,
+                   send_from_directory, stream_with_context, url_for)
 import requests
 
 # --- Environment Configuration ---
 load_dotenv()
 
 from blueprints.admin import bp as admin_bp
-from blueprints.reviews import bp as reviews_bp
+from blueprints.reviews import bp as reviews_bp, reviews_stats, reviews_version
+from channel_catalog import ChannelCatalog, CompiledChannel
+from click_store import WINDOWS as CLICK_WINDOWS, ClickStore
+from epg import EpgGuide
+from horoscope_cache import HoroscopeCache
+from hls_relay import HlsRelay, RelayError
+from horoscope_jobs import JobQueue
+from json_stream import JsonObjectScanner
+from openrouter_client import (CircuitBreaker, DeadlineExceeded, OpenRouterClient, OpenRouterUnavailable,
+                               iter_stream_deltas)
 from connect_db import db as dbutil
+from page_cache import FragmentCache, response_cache
+from review_store import backfill_review_tags
+import sitemaps
+from static_export import export_site
+from stream_health import StreamHealth
 
 # --- OpenRouter API Configuration ---
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 OPENROUTER_MODEL = os.getenv('OPENROUTER_MODEL', 'google/gemma-4-31b-it:free')
 OPENROUTER_API_URL = os.getenv('OPENROUTER_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
+# Stream completions so finished sections can be shown while the rest is generated.
+OPENROUTER_STREAM = os.getenv('OPENROUTER_STREAM', '1') == '1'
 if OPENROUTER_API_KEY:
     logging.info("OpenRouter API configured successfully.")
 else:
@@ -32,24 +56,20 @@ logging.basicConfig(level=logging.INFO)
 SITE_NAME = os.getenv('SITE_NAME', 'TVHUB.ONLINE')
 BASE_URL = os.getenv('BASE_URL', 'https://tvhub.online').rstrip('/')
 CHANNELS_FILE = os.path.join(os.path.dirname(__file__), 'data', 'channels.json')
+# Writable runtime state (click counters, caches) shared by all workers on this host.
+DATA_DIR = os.getenv('DATA_DIR') or os.path.join(os.path.dirname(__file__), 'var')
+os.makedirs(DATA_DIR, exist_ok=True)
 
 # --- Caching ---
-_api_cache = {}
+channel_catalog = ChannelCatalog(CHANNELS_FILE)
 
 
 def load_channels():
-    """Load TV channel metadata from the shared JSON data file."""
-    try:
-        with open(CHANNELS_FILE, 'r', encoding='utf-8') as f:
-            channels = json.load(f)
-    except Exception as e:
-        logging.error("Could not load channels data: %s", e)
-        return {}
-    return {item['channel_id'].lower(): item for item in channels if item.get('channel_id')}
+    """Return the current channel mapping (channel_id -> metadata) from the catalog.
 
-
-def get_channel(channel_id):
-    return load_channels().get((channel_id or '').lower())
+    The mapping is shared by every request and must not be mutated.
+    """
+    return channel_catalog.channels()
 
 
 def get_embed_sources(channel_data):
@@ -59,21 +79,18 @@ def get_embed_sources(channel_data):
     ]
 
 
-def select_embed_source(channel_data, source_id=None):
-    embed_sources = get_embed_sources(channel_data)
-    if source_id:
-        for source in embed_sources:
-            if source.get('id') == source_id:
-                return source
-    for source in embed_sources:
-        if source.get('is_primary'):
-            return source
-    return embed_sources[0] if embed_sources else None
+def get_external_sources(channel_data):
+    return [
+        source for source in channel_data.get('sources', [])
+        if source.get('type') in ('official', 'external') and source.get('url') and source.get('status') != 'inactive'
+    ]
 
 
-def build_home_source_links():
+def build_home_source_links(channels=None):
+    if channels is None:
+        channels = load_channels()
     source_links = {}
-    for channel in load_channels().values():
+    for channel in channels.values():
         channel_id = channel.get('channel_id')
         links = []
         for source in channel.get('sources', []):
@@ -143,21 +160,202 @@ def related_channels(current_channel_id, limit=6):
     return items[:limit]
 
 
+def public_api_channel(channel_data):
+    """Channel metadata safe for the public API: embed stream URLs are stripped."""
+    public_data = {
+        k: v for k, v in channel_data.items()
+        if k not in ('stream_link',)
+    }
+    public_data['sources'] = [
+        {k: v for k, v in source.items() if not (source.get('type') == 'embed' and k == 'url')}
+        for source in channel_data.get('sources', [])
+    ]
+    return public_data
+
+
+def compile_channel(channel_data):
+    embed_sources = tuple(get_embed_sources(channel_data))
+    embed_by_id = {}
+    for source in embed_sources:
+        embed_by_id.setdefault(source.get('id'), source)
+    default_source = next((s for s in embed_sources if s.get('is_primary')), None)
+    if default_source is None and embed_sources:
+        default_source = embed_sources[0]
+    channel_id = channel_data.get('channel_id')
+    return CompiledChannel(
+        channel_id=channel_id,
+        data=MappingProxyType(channel_data),
+        embed_sources=embed_sources,
+        embed_by_id=MappingProxyType(embed_by_id),
+        default_source=default_source,
+        external_sources=tuple(get_external_sources(channel_data)),
+        related=tuple(related_channels(channel_id)),
+        seo=MappingProxyType(build_live_seo(channel_data)),
+        canonical_url=public_url_for('live', channel=channel_id),
+        api_json=app.json.dumps(public_api_channel(channel_data), separators=(',', ':')).encode('utf-8') + b'\n',
+    )
+
+
+def _compile_channels(channels):
+    return {key: compile_channel(channel) for key, channel in channels.items()}
+
+
+def compiled_channel(channel_id):
+    """Return the precompiled view of a channel for the current catalog version."""
+    compiled = channel_catalog.snapshot().derive('compiled_channels', _compile_channels)
+    return compiled.get((channel_id or '').lower())
+
+
 def public_url_for(endpoint, **values):
     return f"{BASE_URL}{url_for(endpoint, **values)}"
 
 
+def home_channel_sources():
+    return channel_catalog.snapshot().derive('home_source_links', build_home_source_links)
+
+
+def channel_list():
+    return channel_catalog.snapshot().derive('channel_list', lambda channels: list(channels.values()))
+
+
+# Homepage tab partials only depend on the catalog and their templates, so they
+# are rendered once per catalog version and reused for every visitor.
+fragment_cache = FragmentCache(app, lambda: channel_catalog.version)
+channel_catalog.subscribe(lambda snapshot: fragment_cache.clear())
+sitemap_cache = sitemaps.SitemapCache()
+
+
+def catalog_version():
+    return channel_catalog.version
+
+
+# Players load the playlists from our pages, so upstream requests look the same way.
+STREAM_REQUEST_HEADERS = {'User-Agent': f'Mozilla/5.0 (compatible; {SITE_NAME})', 'Referer': f'{BASE_URL}/'}
+
+# Embed sources are probed periodically; live pages default to the fastest healthy one.
+STREAM_HEALTH_INTERVAL = int(os.getenv('STREAM_HEALTH_INTERVAL', '300'))
+stream_health = StreamHealth(
+    os.path.join(DATA_DIR, 'stream_health.sqlite3'),
+    max_workers=int(os.getenv('STREAM_HEALTH_CONCURRENCY', '8')),
+    timeout=float(os.getenv('STREAM_HEALTH_TIMEOUT', '5')),
+    max_age=STREAM_HEALTH_INTERVAL * 3,
+    headers=STREAM_REQUEST_HEADERS,
+)
+
+# With HLS_RELAY=1 players poll our /live/<channel>/playlist.m3u8, which fetches
+# the upstream playlist once per refresh window for every viewer of the channel.
+HLS_RELAY = os.getenv('HLS_RELAY', '0') == '1'
+hls_relay = HlsRelay(
+    lambda channel_id, source_id, index: url_for('live_variant', channel=channel_id, index=index, source=source_id),
+    timeout=float(os.getenv('HLS_RELAY_TIMEOUT', '5')),
+    master_ttl=int(os.getenv('HLS_RELAY_MASTER_TTL', '60')),
+    headers=STREAM_REQUEST_HEADERS,
+)
+
+
+def live_page_version():
+    return (channel_catalog.version, stream_health.version)
+
+
+def check_stream_sources(channel_id=None):
+    """Probe the embed sources of every channel (or just ``channel_id``) and store the results."""
+    channels = load_channels()
+    if channel_id:
+        channels = {k: v for k, v in channels.items() if k == channel_id.lower()}
+    return stream_health.check(
+        (channel.get('channel_id'), source)
+        for channel in channels.values() for source in get_embed_sources(channel)
+    )
+
+
+def _stream_health_loop():
+    while True:
+        try:
+            # Another worker's scheduler may have just run the check.
+            last = stream_health.last_checked_at() or 0
+            if time.time() - last >= STREAM_HEALTH_INTERVAL / 2:
+                check_stream_sources()
+        except Exception:
+            logging.exception("Stream health check failed")
+        time.sleep(STREAM_HEALTH_INTERVAL)
+
+
+if os.getenv('STREAM_HEALTH_SCHEDULER', '0') == '1':
+    threading.Thread(target=_stream_health_loop, name='stream-health', daemon=True).start()
+
+
+# Programme guide (XMLTV) for the catalog's channels; `epg_id` on a channel maps it to the feed.
+epg_guide = EpgGuide(
+    os.getenv('EPG_SOURCE', 'https://akkradet.github.io/IPTV-THAI/guide.xml'),
+    os.path.join(DATA_DIR, 'epg_guide.xml'),
+    load_channels,
+    refresh_interval=int(os.getenv('EPG_REFRESH_INTERVAL', '3600')),
+)
+channel_catalog.subscribe(lambda snapshot: epg_guide.invalidate())
+if os.getenv('EPG_REFRESH_SCHEDULER', '0') == '1':
+    epg_guide.start_scheduler()
+
+
+def epg_version():
+    return epg_guide.version
+
+
+# (key, body, etag) of the /api/epg/now payload for the current minute.
+_epg_now = (None, b'', '')
+_epg_now_lock = threading.Lock()
+
+
+def epg_now_payload():
+    """Return (body, etag, seconds left in the minute) for /api/epg/now.
+
+    The payload is built once per minute (and guide/catalog version) for the
+    minute's start, so every worker produces the same bytes and ETag.
+    """
+    global _epg_now
+    now = time.time()
+    minute_start = int(now) // 60 * 60
+    key = (minute_start, epg_guide.version, channel_catalog.version)
+    if _epg_now[0] != key:
+        with _epg_now_lock:
+            if _epg_now[0] != key:
+                payload = {
+                    'at': datetime.fromtimestamp(minute_start).astimezone().isoformat(),
+                    'channels': epg_guide.now_next_all(
+                        [c['channel_id'] for c in load_channels().values()], minute_start,
+                    ),
+                }
+                body = app.json.dumps(payload, separators=(',', ':')).encode('utf-8')
+                _epg_now = (key, body, hashlib.sha1(body).hexdigest())
+    return _epg_now[1], _epg_now[2], max(minute_start + 60 - int(now), 1)
+
+
 @app.context_processor
 def inject_site_context():
     return {
         'site_name': SITE_NAME,
         'base_url': BASE_URL,
         'now': datetime.now,
-        'home_channel_sources': build_home_source_links,
-        'channel_list': lambda: list(load_channels().values()),
+        'home_channel_sources': home_channel_sources,
+        'channel_list': channel_list,
+        'cached_fragment': fragment_cache.render,
     }
 
 # --- Blueprints & DB Setup ---
+def _ensure_index(table, index_name, create_sql):
+    """Create an index unless information_schema already lists it."""
+    row = dbutil.sql_fetchone_params(
+        "SELECT COUNT(*) AS c FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+        (table, index_name),
+    )
+    if row is None:
+        logging.error("Could not check index `%s` on `%s`.", index_name, table)
+        return
+    if not row.get('c'):
+        if dbutil.sql_run_commit(create_sql):
+            logging.info("Created index `%s` on `%s`.", index_name, table)
+
+
 def ensure_tables_and_register_blueprints():
     """Ensure necessary tables exist and register Flask blueprints."""
     try:
@@ -182,6 +380,35 @@ def ensure_tables_and_register_blueprints():
     except Exception as e:
         logging.error(f"Could not ensure `movie_reviews` table exists: {e}")
 
+    # Backs keyset pagination of the public review list (ORDER BY published_at DESC, id DESC).
+    _ensure_index('movie_reviews', 'idx_movie_reviews_published',
+                  "CREATE INDEX idx_movie_reviews_published ON movie_reviews (published_at, id)")
+    # Full-text search; the ngram parser tokenises Thai, which has no word separators.
+    _ensure_index('movie_reviews', 'ft_movie_reviews_title',
+                  "ALTER TABLE movie_reviews ADD FULLTEXT INDEX ft_movie_reviews_title (title) WITH PARSER ngram")
+    _ensure_index('movie_reviews', 'ft_movie_reviews_search',
+                  "ALTER TABLE movie_reviews ADD FULLTEXT INDEX ft_movie_reviews_search "
+                  "(title, excerpt, tags, body) WITH PARSER ngram")
+
+    try:
+        dbutil.sql_run_commit("""
+            CREATE TABLE IF NOT EXISTS review_tags (
+                review_id INT UNSIGNED NOT NULL,
+                tag VARCHAR(64) NOT NULL,
+                PRIMARY KEY (review_id, tag),
+                KEY idx_review_tags_tag (tag, review_id),
+                CONSTRAINT fk_review_tags_review FOREIGN KEY (review_id)
+                    REFERENCES movie_reviews (id) ON DELETE CASCADE
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """)
+        # One-off migration from the comma separated tags column.
+        has_tags = dbutil.sql_fetchone("SELECT 1 AS present FROM review_tags LIMIT 1")
+        has_tagged_reviews = dbutil.sql_fetchone("SELECT 1 AS present FROM movie_reviews WHERE tags IS NOT NULL LIMIT 1")
+        if has_tagged_reviews and not has_tags:
+            backfill_review_tags()
+    except Exception as e:
+        logging.error(f"Could not ensure `review_tags` table exists: {e}")
+
     # reviews blueprint expects '/reviews' prefix; admin blueprint already has '/admin' inside
     app.register_blueprint(reviews_bp, url_prefix='/reviews')
     app.register_blueprint(admin_bp)
@@ -192,85 +419,180 @@ ensure_tables_and_register_blueprints()
 
 # --- Base Routes ---
 @app.route('/')
+@response_cache.cached(version=catalog_version)
 def homepage():
     """Renders the main homepage."""
     return render_template('homepage_new.html')
 
 @app.route('/live/<channel>')
+@response_cache.cached(version=live_page_version, vary=('source',))
 def live(channel):
     """Renders the live stream page for a configured channel."""
-    channel_data = get_channel(channel)
-    if not channel_data:
+    compiled = compiled_channel(channel)
+    if compiled is None:
         abort(404)
 
-    sources = channel_data.get('sources', [])
-    selected_source = select_embed_source(channel_data, request.args.get('source'))
-    embed_sources = get_embed_sources(channel_data)
-    external_sources = [
-        source for source in sources
-        if source.get('type') in ('official', 'external') and source.get('url') and source.get('status') != 'inactive'
-    ]
-    template_data = dict(channel_data)
+    selected_source = compiled.select_source(
+        request.args.get('source'), stream_health.for_channel(compiled.channel_id),
+    )
+    stream_link = selected_source['url'] if selected_source else None
+    if HLS_RELAY and selected_source:
+        stream_link = url_for('live_playlist', channel=compiled.channel_id, source=selected_source['id'])
+    template_data = dict(compiled.data)
     template_data.update({
-        'stream_link': selected_source['url'] if selected_source else None,
+        'stream_link': stream_link,
         'current_source': selected_source,
-        'embed_sources': embed_sources,
-        'external_sources': external_sources,
-        'related_channels': related_channels(channel_data.get('channel_id')),
-        **build_live_seo(channel_data),
+        'embed_sources': compiled.embed_sources,
+        'external_sources': compiled.external_sources,
+        'related_channels': compiled.related,
+        **compiled.seo,
     })
     return render_template(
         'live.html',
-        canonical_url=public_url_for('live', channel=channel_data.get('channel_id')),
+        canonical_url=compiled.canonical_url,
         **template_data
     )
 
+def _relay_source(channel):
+    if not HLS_RELAY:
+        abort(404)
+    compiled = compiled_channel(channel)
+    if compiled is None:
+        abort(404)
+    source = compiled.select_source(request.args.get('source'), stream_health.for_channel(compiled.channel_id))
+    if source is None:
+        abort(404)
+    return compiled.channel_id, source
+
+
+def _playlist_response(body, max_age):
+    response = Response(body, mimetype='application/vnd.apple.mpegurl')
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
+
+
+@app.route('/live/<channel>/playlist.m3u8')
+def live_playlist(channel):
+    """Relay the channel's upstream HLS playlist from the shared cache."""
+    channel_id, source = _relay_source(channel)
+    try:
+        return _playlist_response(*hls_relay.master(channel_id, source))
+    except RelayError:
+        return {"error": "upstream playlist unavailable"}, 502
+
+
+@app.route('/live/<channel>/variant/<int:index>.m3u8')
+def live_variant(channel, index):
+    """Relay a variant or rendition playlist listed in the channel's master playlist."""
+    channel_id, source = _relay_source(channel)
+    try:
+        result = hls_relay.variant(channel_id, source, index)
+    except RelayError:
+        return {"error": "upstream playlist unavailable"}, 502
+    if result is None:
+        abort(404)
+    return _playlist_response(*result)
+
 # --- Legal/Info Pages ---
 @app.route('/privacy')
+@response_cache.cached()
 def privacy():
     return render_template('privacy.html')
 
 @app.route('/terms')
+@response_cache.cached()
 def terms():
     return render_template('terms.html')
 
 @app.route('/contact')
+@response_cache.cached()
 def contact():
     return render_template('contact.html')
 
 # --- SEO & Static Files ---
+def _sitemap_static_entries():
+    """Sitemap (loc, lastmod) entries that do not come from the database."""
+    entries = [
+        (public_url_for('homepage'), None),
+        (public_url_for('privacy'), None),
+        (public_url_for('terms'), None),
+        (public_url_for('contact'), None),
+        (public_url_for('horoscope_list'), None),
+        (public_url_for('horoscope_daily_page'), None),
+        (public_url_for('horoscope_birth_page'), None),
+    ]
+    entries.extend((public_url_for('horoscope_detail', sign=z), None) for z in ZODIAC_SIGNS)
+    snapshot = channel_catalog.snapshot()
+    channels_modified = datetime.fromtimestamp(snapshot.modified_at) if snapshot.modified_at else None
+    entries.extend(
+        (public_url_for('live', channel=channel.get('channel_id')), channels_modified)
+        for channel in snapshot.channels.values()
+        if channel.get('channel_id')
+    )
+    return entries
+
+
+def _sitemap_review_entries(offset, limit):
+    rows = dbutil.sql_iter_params(
+        "SELECT slug, updated_at FROM movie_reviews ORDER BY id DESC LIMIT %s OFFSET %s",
+        (limit, offset),
+    )
+    for row in rows:
+        yield public_url_for('reviews.detail_movie', slug=row['slug']), row.get('updated_at')
+
+
+def _sitemap_page_entries(static_entries, page):
+    """Entries for child sitemap ``page``: static URLs first, then reviews newest first."""
+    start = page * sitemaps.MAX_URLS_PER_SITEMAP
+    end = start + sitemaps.MAX_URLS_PER_SITEMAP
+    yield from static_entries[start:end]
+    review_offset = max(start - len(static_entries), 0)
+    review_limit = end - max(start, len(static_entries))
+    if review_limit > 0:
+        yield from _sitemap_review_entries(review_offset, review_limit)
+
+
+def _sitemap_response(name, build_chunks):
+    version = (reviews_version(), channel_catalog.version)
+    cached = sitemap_cache.get(version, name)
+    if cached is not None:
+        body, etag = cached
+        response = Response(body, mimetype='application/xml')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600
+        return response.make_conditional(request)
+    chunks = sitemap_cache.stream(version, name, build_chunks())
+    return Response(stream_with_context(chunks), mimetype='application/xml')
+
+
 @app.route('/sitemap.xml')
 def sitemap():
-    """Generates a sitemap.xml for SEO."""
-    try:
-        static_urls = [
-            public_url_for('homepage'),
-            public_url_for('privacy'),
-            public_url_for('terms'),
-            public_url_for('contact'),
-            public_url_for('horoscope_list'),
-            public_url_for('horoscope_daily_page'),
-            public_url_for('horoscope_birth_page'),
-        ]
-
-        rows = dbutil.sql_fetchall("SELECT slug FROM movie_reviews ORDER BY id DESC") or []
-        movie_urls = [public_url_for('reviews.detail_movie', slug=row['slug']) for row in rows]
-
-        zodiacs = list(ZODIAC_SIGNS.keys())
-        horoscope_urls = [public_url_for('horoscope_detail', sign=z) for z in zodiacs]
-        live_urls = [
-            public_url_for('live', channel=channel.get('channel_id'))
-            for channel in load_channels().values()
-            if channel.get('channel_id')
-        ]
-
-        all_urls = set(static_urls + movie_urls + horoscope_urls + live_urls)
-
-        sitemap_xml = render_template('sitemap.xml', urls=all_urls)
-        return Response(sitemap_xml, mimetype='application/xml')
-    except Exception as e:
-        logging.error(f"Error generating sitemap: {e}")
-        return "Error generating sitemap.", 500
+    """Generates a sitemap.xml for SEO, or a sitemap index once it outgrows one file."""
+    static_entries = _sitemap_static_entries()
+    stats = reviews_stats()
+    total = len(static_entries) + stats['count']
+    if total <= sitemaps.MAX_URLS_PER_SITEMAP:
+        return _sitemap_response('sitemap', lambda: sitemaps.iter_urlset(
+            _sitemap_page_entries(static_entries, 0)))
+
+    pages = -(-total // sitemaps.MAX_URLS_PER_SITEMAP)
+    lastmod = stats['updated_at']
+    return _sitemap_response('index', lambda: sitemaps.iter_sitemap_index(
+        (public_url_for('sitemap_page', page=page), lastmod) for page in range(1, pages + 1)))
+
+
+@app.route('/sitemap-<int:page>.xml')
+def sitemap_page(page):
+    """Child sitemap of the sitemap index (1-based)."""
+    if page < 1:
+        abort(404)
+    static_entries = _sitemap_static_entries()
+    if (page - 1) * sitemaps.MAX_URLS_PER_SITEMAP >= len(static_entries) + reviews_stats()['count']:
+        abort(404)
+    return _sitemap_response(f'page-{page}', lambda: sitemaps.iter_urlset(
+        _sitemap_page_entries(static_entries, page - 1)))
 
 
 @app.route('/robots.txt')
@@ -295,6 +617,42 @@ ZODIAC_SIGNS = {
     'libra': 'ราศีตุลย์', 'scorpio': 'ราศีพิจิก', 'sagittarius': 'ราศีธนู',
     'capricorn': 'ราศีมังกร', 'aquarius': 'ราศีกุมภ์', 'pisces': 'ราศีมีน'
 }
+openrouter = OpenRouterClient(
+    OPENROUTER_API_URL,
+    OPENROUTER_API_KEY,
+    headers={
+        'HTTP-Referer': BASE_URL,
+        'X-Title': SITE_NAME,
+    },
+    pool_size=int(os.getenv('OPENROUTER_POOL_SIZE', '10')),
+    deadline=float(os.getenv('OPENROUTER_DEADLINE', '60')),
+    attempt_timeout=float(os.getenv('OPENROUTER_ATTEMPT_TIMEOUT', '35')),
+    max_retries=int(os.getenv('OPENROUTER_MAX_RETRIES', '3')),
+    breaker=CircuitBreaker(
+        threshold=int(os.getenv('OPENROUTER_BREAKER_THRESHOLD', '5')),
+        reset_timeout=float(os.getenv('OPENROUTER_BREAKER_RESET', '60')),
+    ),
+)
+# Per-kind TTLs (seconds) for cached AI results; entries are keyed by date anyway.
+HOROSCOPE_CACHE_TTLS = {
+    'sign': int(os.getenv('HOROSCOPE_TTL_SIGN', '93600')),
+    'daily': int(os.getenv('HOROSCOPE_TTL_DAILY', '93600')),
+    'weekly': int(os.getenv('HOROSCOPE_TTL_WEEKLY', '93600')),
+    'birth': int(os.getenv('HOROSCOPE_TTL_BIRTH', '86400')),
+}
+horoscope_cache = HoroscopeCache(
+    os.path.join(DATA_DIR, 'horoscope_cache.sqlite3'),
+    ttls=HOROSCOPE_CACHE_TTLS,
+    max_entries=int(os.getenv('HOROSCOPE_CACHE_MAX_ENTRIES', '20000')),
+    max_bytes=int(os.getenv('HOROSCOPE_CACHE_MAX_BYTES', str(50 * 1024 * 1024))),
+    error_ttl=int(os.getenv('HOROSCOPE_ERROR_TTL', '60')),
+)
+# Cold generations run as background jobs so OpenRouter latency never holds a request worker.
+horoscope_jobs = JobQueue(
+    os.path.join(DATA_DIR, 'horoscope_jobs.sqlite3'),
+    max_workers=int(os.getenv('HOROSCOPE_JOB_WORKERS', '4')),
+)
+HOROSCOPE_JOB_MAX_WAIT = float(os.getenv('HOROSCOPE_JOB_MAX_WAIT', '10'))
 DAYS_OF_WEEK = {
     "monday": "วันจันทร์", "tuesday": "วันอังคาร", "wednesday": "วันพุธ",
     "thursday": "วันพฤหัสบดี", "friday": "วันศุกร์", "saturday": "วันเสาร์", "sunday": "วันอาทิตย์"
@@ -342,6 +700,42 @@ def calc_age(birthdate: datetime) -> int:
     return years
 
 
+# Age ranges used to share birthdate horoscopes between people with the same profile.
+BIRTH_AGE_BUCKETS = [(0, 12), (13, 19), (20, 29), (30, 39), (40, 49), (50, 59), (60, None)]
+# 'exact' caches one reading per birthdate; 'bucket' shares readings per
+# (weekday, western sign, Chinese zodiac, age range) and merges in each user's meta.
+HOROSCOPE_BIRTH_MODE = os.getenv('HOROSCOPE_BIRTH_MODE', 'exact')
+
+
+def age_bucket(age: int) -> str:
+    for low, high in BIRTH_AGE_BUCKETS:
+        if high is None or age <= high:
+            return f"{low}-{high}" if high is not None else f"{low}+"
+    return ''
+
+
+def birth_profile(bd: datetime) -> dict:
+    """The birthdate facts a birthdate horoscope is generated from."""
+    wk = (bd.weekday() + 1) % 7  # convert Mon=0..Sun=6 -> Sun=0..Sat=6
+    western_sign = detect_western_zodiac(bd.month, bd.day)
+    age = calc_age(bd)
+    return {
+        'birthdate': bd.strftime('%Y-%m-%d'),
+        'weekday': wk,
+        'weekday_th': THAI_WEEKDAYS_FULL[wk],
+        'western_sign': western_sign,
+        'western_sign_th': ZODIAC_SIGNS.get(western_sign, western_sign),
+        'chinese_index': (bd.year - 1900) % 12,
+        'chinese_th': detect_chinese_zodiac_th(bd.year),
+        'age': age,
+        'age_bucket': age_bucket(age),
+    }
+
+
+def birth_bucket_subject(profile: dict) -> str:
+    return f"w{profile['weekday']}-{profile['western_sign']}-c{profile['chinese_index']}-a{profile['age_bucket']}"
+
+
 def _parse_ai_json(text: str):
     cleaned = re.sub(r'^```json\s*|```\s*$', '', (text or '').strip(), flags=re.IGNORECASE | re.MULTILINE)
     try:
@@ -354,32 +748,9 @@ def _parse_ai_json(text: str):
 
 
 def _extract_balanced_json_object(text: str) -> str | None:
-    start = text.find('{')
-    if start == -1:
-        return None
-
-    depth = 0
-    in_string = False
-    escape = False
-    for i, char in enumerate(text[start:], start=start):
-        if in_string:
-            if escape:
-                escape = False
-            elif char == '\\':
-                escape = True
-            elif char == '"':
-                in_string = False
-            continue
-
-        if char == '"':
-            in_string = True
-        elif char == '{':
-            depth += 1
-        elif char == '}':
-            depth -= 1
-            if depth == 0:
-                return text[start:i + 1]
-    return None
+    scanner = JsonObjectScanner()
+    scanner.feed(text)
+    return scanner.text if scanner.complete else None
 
 
 def _extract_openrouter_text(payload: dict) -> str:
@@ -407,12 +778,6 @@ def _openrouter_json(prompt: str, max_tokens: int = 3000) -> dict:
         logging.error(msg)
         return {"error": msg}
 
-    headers = {
-        'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-        'Content-Type': 'application/json',
-        'HTTP-Referer': BASE_URL,
-        'X-Title': SITE_NAME,
-    }
     payload = {
         'model': OPENROUTER_MODEL,
         'messages': [
@@ -427,35 +792,29 @@ def _openrouter_json(prompt: str, max_tokens: int = 3000) -> dict:
         'response_format': {'type': 'json_object'},
     }
 
+    # One deadline covers the fallback and truncation retries below.
+    budget = openrouter.budget()
     try:
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload, timeout=35)
-        if response.status_code == 400:
-            fallback_payload = dict(payload)
-            fallback_payload.pop('response_format', None)
-            response = requests.post(OPENROUTER_API_URL, headers=headers, json=fallback_payload, timeout=35)
-        response.raise_for_status()
-
-        response_payload = response.json()
-        choices = response_payload.get('choices') or []
-        finish_reason = choices[0].get('finish_reason') if choices else None
-        if finish_reason == 'length':
-            logging.warning("OpenRouter response was truncated; retrying with a larger token budget.")
-            retry_payload = dict(payload)
-            retry_payload['max_tokens'] = max(max_tokens, 3500)
-            retry_payload['temperature'] = 0.1
-            retry_payload['messages'] = [
-                {
-                    'role': 'system',
-                    'content': 'Return one complete minified JSON object only. No markdown, no explanations.',
-                },
-                {'role': 'user', 'content': prompt + '\n\nตอบใหม่แบบสั้นมาก ทุก value ไม่เกิน 90 ตัวอักษร และต้องปิดวงเล็บ JSON ให้ครบ'},
-            ]
-            retry_response = requests.post(OPENROUTER_API_URL, headers=headers, json=retry_payload, timeout=45)
-            if retry_response.status_code == 400:
-                retry_payload.pop('response_format', None)
-                retry_response = requests.post(OPENROUTER_API_URL, headers=headers, json=retry_payload, timeout=45)
-            retry_response.raise_for_status()
-            response_payload = retry_response.json()
+        if OPENROUTER_STREAM:
+            data = _openrouter_stream_json(payload, budget, horoscope_jobs.report_partial)
+            if data is not None:
+                return data
+            logging.warning("OpenRouter stream ended inside the JSON object; retrying with a shorter answer.")
+            response_payload = _openrouter_compact_retry(payload, prompt, max_tokens, budget)
+        else:
+            response = openrouter.post(payload, budget)
+            if response.status_code == 400:
+                fallback_payload = dict(payload)
+                fallback_payload.pop('response_format', None)
+                response = openrouter.post(fallback_payload, budget)
+            response.raise_for_status()
+
+            response_payload = response.json()
+            choices = response_payload.get('choices') or []
+            finish_reason = choices[0].get('finish_reason') if choices else None
+            if finish_reason == 'length':
+                logging.warning("OpenRouter response was truncated; retrying with a larger token budget.")
+                response_payload = _openrouter_compact_retry(payload, prompt, max_tokens, budget)
 
         text = _extract_openrouter_text(response_payload)
         if not text:
@@ -476,23 +835,78 @@ def _openrouter_json(prompt: str, max_tokens: int = 3000) -> dict:
             return {"error": "ยืนยันตัวตน OpenRouter ไม่สำเร็จ กรุณาตรวจสอบ OPENROUTER_API_KEY"}
         logging.error("Error calling OpenRouter API: %s", e)
         return {"error": "Could not retrieve horoscope data."}
+    except OpenRouterUnavailable as e:
+        logging.error("OpenRouter unavailable: %s", e)
+        return {"error": "บริการดูดวงไม่พร้อมใช้งานชั่วคราว กรุณาลองใหม่ภายหลัง"}
     except requests.RequestException as e:
         logging.error("Error calling OpenRouter API: %s", e)
         return {"error": "Could not retrieve horoscope data."}
 
 
-def get_openrouter_horoscope(sign: str) -> dict:
+def _openrouter_compact_retry(payload: dict, prompt: str, max_tokens: int, budget) -> dict:
+    """Ask again for a shorter answer after the first one was cut off; returns the completion payload."""
+    retry_payload = dict(payload)
+    retry_payload['max_tokens'] = max(max_tokens, 3500)
+    retry_payload['temperature'] = 0.1
+    retry_payload['messages'] = [
+        {
+            'role': 'system',
+            'content': 'Return one complete minified JSON object only. No markdown, no explanations.',
+        },
+        {'role': 'user', 'content': prompt + '\n\nตอบใหม่แบบสั้นมาก ทุก value ไม่เกิน 90 ตัวอักษร และต้องปิดวงเล็บ JSON ให้ครบ'},
+    ]
+    retry_response = openrouter.post(retry_payload, budget, timeout=45)
+    if retry_response.status_code == 400:
+        retry_payload.pop('response_format', None)
+        retry_response = openrouter.post(retry_payload, budget, timeout=45)
+    retry_response.raise_for_status()
+    return retry_response.json()
+
+
+def _openrouter_stream_json(payload: dict, budget, on_section=None) -> dict | None:
+    """Stream a completion and return its JSON object, or None if the stream ended inside it.
+
+    Top-level members are passed to ``on_section(key, value)`` as soon as they
+    are complete, and reading stops at the object's closing brace.
+    """
+    stream_payload = dict(payload, stream=True)
+    response = openrouter.post(stream_payload, budget, stream=True)
+    if response.status_code == 400:
+        response.close()
+        stream_payload.pop('response_format', None)
+        response = openrouter.post(stream_payload, budget, stream=True)
+    scanner = JsonObjectScanner()
+    with response:
+        response.raise_for_status()
+        for content, _ in iter_stream_deltas(response):
+            for key, value in scanner.feed(content):
+                if on_section:
+                    on_section(key, value)
+            if scanner.complete:
+                break
+            if not budget.remaining():
+                raise DeadlineExceeded("OpenRouter deadline exceeded while streaming")
+    if not scanner.complete:
+        return None
+    return json.loads(scanner.text)
+
+
+def _today_period() -> str:
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def get_openrouter_horoscope(sign: str, period: str | None = None, allow_stale: bool = True) -> dict:
     """
     Generates a 7-day horoscope forecast using OpenRouter and caches it daily.
     """
-    today_str = datetime.now().strftime('%Y-%m-%d')
-    cache_key = f"horoscope_{sign}_{today_str}"
+    period = period or _today_period()
+    return horoscope_cache.get_or_create(
+        'sign', sign, period, lambda: _generate_sign_horoscope(sign), allow_stale=allow_stale
+    )
 
-    if cache_key in _api_cache:
-        logging.info(f"CACHE HIT for {cache_key}")
-        return _api_cache[cache_key]
 
-    logging.info(f"CACHE MISS for {cache_key}. Calling OpenRouter API.")
+def _generate_sign_horoscope(sign: str) -> dict:
+    logging.info(f"CACHE MISS for horoscope {sign}. Calling OpenRouter API.")
 
     try:
         thai_sign = ZODIAC_SIGNS.get(sign, sign)
@@ -516,25 +930,22 @@ def get_openrouter_horoscope(sign: str) -> dict:
             + "}"
         )
 
-        data = _openrouter_json(prompt)
-        if 'error' in data:
-            return data
-
-        _api_cache[cache_key] = data
-        return data
+        return _openrouter_json(prompt)
 
     except Exception as e:
         logging.error(f"Error generating horoscope for sign '{sign}': {e}")
         return {"error": "Could not retrieve horoscope data."}
 
 
-def get_openrouter_daily() -> dict:
+def get_openrouter_daily(period: str | None = None, allow_stale: bool = True) -> dict:
     """Generates today's general daily horoscope (no zodiac) and caches by date."""
-    today_str = datetime.now().strftime('%Y-%m-%d')
-    cache_key = f"horoscope_daily_{today_str}"
-    if cache_key in _api_cache:
-        return _api_cache[cache_key]
+    period = period or _today_period()
+    return horoscope_cache.get_or_create(
+        'daily', 'general', period, _generate_daily_horoscope, allow_stale=allow_stale
+    )
 
+
+def _generate_daily_horoscope() -> dict:
     try:
         prompt = (
             "จงทำนายดวงชะตาประจำวันนี้ (ไม่ระบุราศี) เป็นภาษาไทย โดยตอบเป็น JSON เท่านั้นและห้ามมีข้อความอื่นนอก JSON:\n"
@@ -545,24 +956,21 @@ def get_openrouter_daily() -> dict:
             + "}"
         )
 
-        data = _openrouter_json(prompt)
-        if 'error' in data:
-            return data
-
-        _api_cache[cache_key] = data
-        return data
+        return _openrouter_json(prompt)
     except Exception as e:
         logging.error(f"Error generating daily horoscope: {e}")
         return {"error": "Could not retrieve daily horoscope."}
 
 
-def get_openrouter_weekly_general() -> dict:
+def get_openrouter_weekly_general(period: str | None = None, allow_stale: bool = True) -> dict:
     """Generates a general weekly (Mon-Sun) horoscope without zodiac and caches by date."""
-    today_str = datetime.now().strftime('%Y-%m-%d')
-    cache_key = f"horoscope_weekly_general_{today_str}"
-    if cache_key in _api_cache:
-        return _api_cache[cache_key]
+    period = period or _today_period()
+    return horoscope_cache.get_or_create(
+        'weekly', 'general', period, _generate_weekly_horoscope, allow_stale=allow_stale
+    )
+
 
+def _generate_weekly_horoscope() -> dict:
     try:
         prompt = (
             "จงทำนายดวงชะตารายสัปดาห์ 7 วัน (จันทร์-อาทิตย์) แบบทั่วไป (ไม่ระบุราศี) เป็นภาษาไทย "
@@ -583,23 +991,17 @@ def get_openrouter_weekly_general() -> dict:
             + "}"
         )
 
-        data = _openrouter_json(prompt)
-        if 'error' in data:
-            return data
-
-        _api_cache[cache_key] = data
-        return data
+        return _openrouter_json(prompt)
     except Exception as e:
         logging.error(f"Error generating weekly general horoscope: {e}")
         return {"error": "Could not retrieve weekly horoscope."}
 
-def get_openrouter_birthdate(birthdate_str: str) -> dict:
-    """Generates a personalized horoscope based on birth date (YYYY-MM-DD). Cached per birthdate per day."""
-    today_str = datetime.now().strftime('%Y-%m-%d')
-    cache_key = f"horoscope_birth_{birthdate_str}_{today_str}"
-    if cache_key in _api_cache:
-        return _api_cache[cache_key]
+def get_openrouter_birthdate(birthdate_str: str, allow_stale: bool = True) -> dict:
+    """Generates a personalized horoscope based on birth date (YYYY-MM-DD).
 
+    Cached per day, either per birthdate or per birth profile bucket depending
+    on ``HOROSCOPE_BIRTH_MODE``.
+    """
     # Parse and compute metadata
     try:
         bd = datetime.strptime(birthdate_str, '%Y-%m-%d')
@@ -609,25 +1011,54 @@ def get_openrouter_birthdate(birthdate_str: str) -> dict:
     if bd.date() > datetime.today().date():
         return {"error": "วันเกิดอยู่ในอนาคต กรุณาตรวจสอบอีกครั้ง"}
 
-    weekday_th = THAI_WEEKDAYS_FULL[bd.weekday() if hasattr(bd, 'weekday') else 0]
-    # Python weekday(): Monday=0 ... Sunday=6; THAI_WEEKDAYS_FULL starts Sunday=0, so adjust
-    # Correct adjustment:
-    wk = (bd.weekday() + 1) % 7  # convert Mon=0..Sun=6 -> Sun=0..Sat=6
-    weekday_th = THAI_WEEKDAYS_FULL[wk]
+    profile = birth_profile(bd)
+    data = horoscope_cache.get_or_create(
+        'birth', birth_cache_subject(profile), _today_period(),
+        lambda: _generate_birth_horoscope(profile), allow_stale=allow_stale,
+    )
+    return with_birth_meta(data, profile)
 
-    western_sign = detect_western_zodiac(bd.month, bd.day)
-    western_sign_th = ZODIAC_SIGNS.get(western_sign, western_sign)
-    chinese_th = detect_chinese_zodiac_th(bd.year)
-    age_years = calc_age(bd)
+
+def birth_cache_subject(profile: dict) -> str:
+    if HOROSCOPE_BIRTH_MODE == 'bucket':
+        return birth_bucket_subject(profile)
+    return profile['birthdate']
+
+
+def with_birth_meta(data: dict, profile: dict) -> dict:
+    """Return a copy of a birthdate reading with ``meta`` describing this user's birthdate."""
+    if not isinstance(data, dict) or 'error' in data:
+        return data
+    data = dict(data)
+    meta = dict(data.get('meta') or {})
+    meta.update({
+        'birthdate': profile['birthdate'],
+        'weekday_th': profile['weekday_th'],
+        'western_zodiac': profile['western_sign_th'],
+        'thai_zodiac': profile['chinese_th'],
+        'age': profile['age'],
+    })
+    data['meta'] = meta
+    return data
+
+
+def _generate_birth_horoscope(profile: dict) -> dict:
+    if HOROSCOPE_BIRTH_MODE == 'bucket':
+        # Only what the bucket key covers, so the reading fits everyone in it.
+        birth_line = f"เกิด{profile['weekday_th']}\\n"
+        age_line = f"ช่วงอายุ: {profile['age_bucket']} ปี\\n\n"
+    else:
+        birth_line = f"วันเกิด: {profile['birthdate']} ({profile['weekday_th']})\\n"
+        age_line = f"อายุโดยประมาณ: {profile['age']} ปี\\n\n"
 
     try:
         prompt = (
             "จงทำนายดวงเฉพาะบุคคลจากวันเดือนปีเกิด โดยใช้ข้อมูลต่อไปนี้เป็นบริบทและจงตอบเป็น JSON เท่านั้น (ห้ามมีข้อความนอก JSON):\n"
-            f"วันเกิด: {bd.strftime('%Y-%m-%d')} ({weekday_th})\\n"
-            f"ราศีตะวันตก: {ZODIAC_SIGNS.get(western_sign, western_sign)}\\n"
-            f"นักษัตรจีน: {chinese_th}\\n"
-            f"อายุโดยประมาณ: {age_years} ปี\\n\n"
-            "ให้วิเคราะห์แบบสั้น กระชับ แต่มีสาระและมีคำแนะนำที่ปฏิบัติได้จริง โดยมีโครงสร้าง JSON ดังนี้:\n"
+            + birth_line
+            + f"ราศีตะวันตก: {profile['western_sign_th']}\\n"
+            + f"นักษัตรจีน: {profile['chinese_th']}\\n"
+            + age_line
+            + "ให้วิเคราะห์แบบสั้น กระชับ แต่มีสาระและมีคำแนะนำที่ปฏิบัติได้จริง โดยมีโครงสร้าง JSON ดังนี้:\n"
             "{\n"
             "  \"meta\": {\n"
             "    \"birthdate\": \"YYYY-MM-DD\", \"weekday_th\": \"...\", \"western_zodiac\": \"...\", \"thai_zodiac\": \"...\", \"age\": 0\n"
@@ -642,28 +1073,23 @@ def get_openrouter_birthdate(birthdate_str: str) -> dict:
             "  \"advice\": \"...\"\n"
             "}"
         )
-
-        data = _openrouter_json(prompt)
-        if 'error' in data:
-            return data
-
-        # Enrich/ensure meta fields
-        meta = data.get('meta', {}) if isinstance(data, dict) else {}
-        meta.setdefault('birthdate', birthdate_str)
-        meta.setdefault('weekday_th', weekday_th)
-        meta.setdefault('western_zodiac', western_sign_th)
-        meta.setdefault('thai_zodiac', chinese_th)
-        meta.setdefault('age', age_years)
-        if isinstance(data, dict):
-            data['meta'] = meta
-
-        _api_cache[cache_key] = data
-        return data
+        return _openrouter_json(prompt)
     except Exception as e:
         logging.error(f"Error generating birth horoscope: {e}")
         return {"error": "Could not retrieve birthdate horoscope."}
 
 
+def birth_bucket_profiles(max_age: int = 100) -> list:
+    """One representative profile per bucket reachable by a birthdate, most common age ranges first."""
+    today = datetime.today()
+    profiles = {}
+    for offset in range(max_age * 366):
+        profile = birth_profile(today - timedelta(days=offset))
+        profiles.setdefault(birth_bucket_subject(profile), profile)
+    priority = ['20-29', '30-39', '40-49', '13-19', '50-59', '60+', '0-12']
+    return sorted(profiles.values(), key=lambda p: priority.index(p['age_bucket']))
+
+
 def _normalize_birthdate_input(birthdate: str) -> str:
     """Accepts either ISO 'YYYY-MM-DD' (ค.ศ.) or 'dd/mm/yyyy' (พ.ศ./ค.ศ.) and returns ISO 'YYYY-MM-DD' (ค.ศ.).
     Raises ValueError if invalid.
@@ -689,11 +1115,13 @@ def _normalize_birthdate_input(birthdate: str) -> str:
     raise ValueError("รูปแบบวันที่ไม่ถูกต้อง รองรับ YYYY-MM-DD หรือ dd/mm/yyyy (พ.ศ.)")
 
 @app.route('/horoscope/')
+@response_cache.cached()
 def horoscope_list():
     """Displays the list of zodiac signs."""
     return render_template('horoscope/list.html', signs=ZODIAC_SIGNS)
 
 @app.route('/horoscope/<sign>')
+@response_cache.cached()
 def horoscope_detail(sign: str):
     """Displays the 7-day horoscope for a given zodiac sign."""
     if sign not in ZODIAC_SIGNS:
@@ -709,18 +1137,39 @@ def horoscope_detail(sign: str):
     )
 
 
+def _job_response(job, error_status=500):
+    if job['status'] == 'done':
+        return job['result'], 200
+    if job['status'] == 'error':
+        return job['result'], error_status
+    return {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'status_url': url_for('api_horoscope_job', job_id=job['job_id']),
+    }, 202
+
+
+def _horoscope_response(kind, subject, generate, creator):
+    """Serve a cached (or stale) horoscope, or start a generation job and answer 202 with its status URL.
+
+    ``generate`` is the cached entry point run by the job; ``creator`` builds
+    the value when a stale copy is refreshed in the background.
+    """
+    period = _today_period()
+    cached = horoscope_cache.get_or_stale(kind, subject, period, creator)
+    if cached is not None:
+        return cached, 200
+    return _job_response(horoscope_jobs.submit(HoroscopeCache.make_key(kind, subject, period), generate))
+
+
 @app.get('/api/horoscope/daily')
 def api_horoscope_daily():
-    data = get_openrouter_daily()
-    status = 200 if 'error' not in data else 500
-    return data, status
+    return _horoscope_response('daily', 'general', get_openrouter_daily, _generate_daily_horoscope)
 
 
 @app.get('/api/horoscope/weekly')
 def api_horoscope_weekly():
-    data = get_openrouter_weekly_general()
-    status = 200 if 'error' not in data else 500
-    return data, status
+    return _horoscope_response('weekly', 'general', get_openrouter_weekly_general, _generate_weekly_horoscope)
 
 
 @app.route('/horoscope/daily')
@@ -728,14 +1177,27 @@ def horoscope_daily_page():
     return render_template('horoscope/daily.html')
 
 
+@app.get('/api/horoscope/jobs/<job_id>')
+def api_horoscope_job(job_id: str):
+    """Job status; ``?wait=N`` long-polls up to N seconds for the result."""
+    wait = request.args.get('wait', 0, type=float)
+    # float() accepts "nan" and "inf", which would slip through the clamp below.
+    if not math.isfinite(wait):
+        return {"error": "invalid wait"}, 400
+    job = horoscope_jobs.wait(job_id, min(max(wait, 0), HOROSCOPE_JOB_MAX_WAIT))
+    if job is None:
+        return {"error": "job not found"}, 404
+    return job
+
+
 @app.get('/api/horoscope/<sign>')
 def api_horoscope(sign: str):
     """Returns horoscope JSON for a given sign."""
     if sign not in ZODIAC_SIGNS:
         return {"error": "invalid sign"}, 404
-    data = get_openrouter_horoscope(sign)
-    status = 200 if 'error' not in data else 500
-    return data, status
+    return _horoscope_response(
+        'sign', sign, partial(get_openrouter_horoscope, sign), partial(_generate_sign_horoscope, sign),
+    )
 
 
 # --- Birthdate Horoscope Routes ---
@@ -756,29 +1218,124 @@ def api_horoscope_birth():
             birthdate_iso = _normalize_birthdate_input(birthdate_raw)
         except Exception as e:
             return {"error": str(e) or "รูปแบบวันเกิดไม่ถูกต้อง"}, 400
-        data = get_openrouter_birthdate(birthdate_iso)
-        status = 200 if 'error' not in data else 400
-        return data, status
+        bd = datetime.strptime(birthdate_iso, '%Y-%m-%d')
+        if bd.date() > datetime.today().date():
+            return {"error": "วันเกิดอยู่ในอนาคต กรุณาตรวจสอบอีกครั้ง"}, 400
+        profile = birth_profile(bd)
+        period = _today_period()
+        cached = horoscope_cache.get_or_stale(
+            'birth', birth_cache_subject(profile), period, partial(_generate_birth_horoscope, profile),
+        )
+        if cached is not None:
+            return with_birth_meta(cached, profile), 200 if 'error' not in cached else 400
+        # Keyed per birthdate: the result carries this user's meta even when the reading is shared.
+        job = horoscope_jobs.submit(f"birth:{birthdate_iso}:{period}", partial(get_openrouter_birthdate, birthdate_iso))
+        # A reading that could not be generated has always been a 400 for this endpoint.
+        return _job_response(job, error_status=400)
     except Exception as e:
         logging.error(f"/api/horoscope/birth error: {e}")
         return {"error": "เกิดข้อผิดพลาดที่เซิร์ฟเวอร์"}, 500
 
-# --- Channel Click Tracking ---
-_CLICKS_FILE = os.path.join(os.path.dirname(__file__), 'channel_clicks.json')
+# --- Horoscope Warm-up ---
+HOROSCOPE_WARM_CONCURRENCY = int(os.getenv('HOROSCOPE_WARM_CONCURRENCY', '3'))
+# Seconds before midnight at which the scheduler generates the next day's forecasts.
+HOROSCOPE_WARM_LEAD = int(os.getenv('HOROSCOPE_WARM_LEAD', '1800'))
+# Failed entries are retried this many times, waiting RETRY_DELAY seconds and doubling each time.
+HOROSCOPE_WARM_RETRIES = int(os.getenv('HOROSCOPE_WARM_RETRIES', '3'))
+HOROSCOPE_WARM_RETRY_DELAY = int(os.getenv('HOROSCOPE_WARM_RETRY_DELAY', '60'))
 
-def _load_clicks():
-    try:
-        with open(_CLICKS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {}
 
-def _save_clicks(data):
-    try:
-        with open(_CLICKS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logging.error(f"Could not save clicks: {e}")
+def warm_horoscopes(period: str | None = None, concurrency: int = HOROSCOPE_WARM_CONCURRENCY,
+                    names: list | None = None) -> dict:
+    """Generate all sign forecasts plus the daily and weekly horoscopes for ``period`` into the cache.
+
+    Entries that are already cached are skipped; at most ``concurrency``
+    OpenRouter calls run at once. ``names`` limits the run to those entries
+    (as listed in a report's ``failed``).
+    """
+    period = period or _today_period()
+    jobs = {
+        f"sign:{sign}": partial(get_openrouter_horoscope, sign, period, allow_stale=False)
+        for sign in ZODIAC_SIGNS
+    }
+    jobs['daily'] = partial(get_openrouter_daily, period, allow_stale=False)
+    jobs['weekly'] = partial(get_openrouter_weekly_general, period, allow_stale=False)
+    if names is not None:
+        jobs = {name: job for name, job in jobs.items() if name in names}
+
+    started = time.monotonic()
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='horoscope-warm') as pool:
+        futures = {name: pool.submit(job) for name, job in jobs.items()}
+        for name, future in futures.items():
+            try:
+                result = future.result()
+            except Exception:
+                logging.exception("Warming horoscope %s failed", name)
+                result = None
+            if not isinstance(result, dict) or 'error' in result:
+                failed.append(name)
+    report = {
+        'period': period,
+        'ok': len(jobs) - len(failed),
+        'failed': failed,
+        'elapsed_ms': int((time.monotonic() - started) * 1000),
+    }
+    logging.info("Warmed horoscopes for %s: %d ok, %d failed in %d ms",
+                 period, report['ok'], len(failed), report['elapsed_ms'])
+    return report
+
+
+def _warm_with_retries(period: str, deadline: datetime) -> dict:
+    """Warm ``period``, then retry failed entries with backoff while ``deadline`` allows."""
+    report = warm_horoscopes(period)
+    for attempt in range(HOROSCOPE_WARM_RETRIES):
+        if not report['failed']:
+            break
+        delay = HOROSCOPE_WARM_RETRY_DELAY * 2 ** attempt
+        if datetime.now() + timedelta(seconds=delay) >= deadline:
+            break
+        logging.info("Retrying %d horoscope warm-ups for %s in %d s", len(report['failed']), period, delay)
+        time.sleep(delay)
+        report = warm_horoscopes(period, names=report['failed'])
+    return report
+
+
+def _horoscope_warm_loop():
+    """Keep today's horoscopes cached and generate tomorrow's shortly before midnight."""
+    while True:
+        try:
+            now = datetime.now()
+            midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+            warm_at = midnight - timedelta(seconds=HOROSCOPE_WARM_LEAD)
+            if now < warm_at:
+                _warm_with_retries(_today_period(), warm_at)
+                time.sleep(max((warm_at - datetime.now()).total_seconds(), 0))
+                continue
+            _warm_with_retries(midnight.strftime('%Y-%m-%d'), midnight)
+            time.sleep(max((midnight - datetime.now()).total_seconds(), 0) + 60)
+        except Exception:
+            logging.exception("Horoscope warm-up failed")
+            time.sleep(60)
+
+
+# Every worker may run the scheduler; cache leases make sure each forecast is generated once.
+if OPENROUTER_API_KEY and os.getenv('HOROSCOPE_WARM_SCHEDULER', '0') == '1':
+    threading.Thread(target=_horoscope_warm_loop, name='horoscope-warmer', daemon=True).start()
+
+# --- Channel Click Tracking ---
+# The pre-SQLite counters file; docker-compose deployments put it in DATA_DIR.
+_LEGACY_CLICKS_FILE = next(
+    (path for path in (os.path.join(DATA_DIR, 'channel_clicks.json'),
+                       os.path.join(os.path.dirname(__file__), 'channel_clicks.json'))
+     if os.path.isfile(path)),
+    None,
+)
+click_store = ClickStore(
+    os.path.join(DATA_DIR, 'channel_clicks.sqlite3'),
+    flush_interval=float(os.getenv('CLICKS_FLUSH_INTERVAL', '2')),
+    legacy_json_path=_LEGACY_CLICKS_FILE,
+)
 
 @app.post('/api/channel-click')
 def api_channel_click():
@@ -791,39 +1348,236 @@ def api_channel_click():
         logo = payload.get('logo', '')
         link = payload.get('link', '')
 
-        clicks = _load_clicks()
-        key = name
-        if key in clicks:
-            clicks[key]['clicks'] = clicks[key].get('clicks', 0) + 1
-        else:
-            clicks[key] = {'name': name, 'logo': logo, 'link': link, 'clicks': 1}
-        _save_clicks(clicks)
+        click_store.record(name, logo, link)
         return {"ok": True}, 200
     except Exception as e:
         logging.error(f"/api/channel-click error: {e}")
         return {"error": str(e)}, 500
 
+POPULAR_TTL = int(os.getenv('POPULAR_TTL', '30'))
+
 @app.get('/api/popular')
+@response_cache.cached(vary=('window', 'limit'), max_age=POPULAR_TTL, ttl=POPULAR_TTL)
 def api_popular():
-    """Return top 10 popular channels."""
-    clicks = _load_clicks()
-    sorted_channels = sorted(clicks.values(), key=lambda x: x.get('clicks', 0), reverse=True)[:10]
-    return {"channels": sorted_channels}, 200
+    """Return the most clicked channels, all-time or for a rolling window (1h, 24h, 7d)."""
+    window = request.args.get('window', 'all')
+    if window not in CLICK_WINDOWS:
+        return {"error": "invalid window", "windows": list(CLICK_WINDOWS)}, 400
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        return {"error": "invalid limit"}, 400
+    try:
+        return {"window": window, "channels": click_store.top(limit, window)}, 200
+    except Exception as e:
+        logging.error(f"/api/popular error: {e}")
+        # Not a 200, so response_cache does not keep the empty list for POPULAR_TTL.
+        return {"error": "popular channels unavailable", "window": window, "channels": []}, 503
+
+@app.get('/api/catalog/status')
+def api_catalog_status():
+    """Expose channel catalog reload metrics for monitoring."""
+    return channel_catalog.stats(), 200
 
 @app.get('/api/channels/<channel>')
 def api_channel(channel):
-    channel_data = get_channel(channel)
-    if not channel_data:
+    compiled = compiled_channel(channel)
+    if compiled is None:
         return {"error": "channel not found"}, 404
-    public_data = {
-        k: v for k, v in channel_data.items()
-        if k not in ('stream_link',)
-    }
-    public_data['sources'] = [
-        {k: v for k, v in source.items() if not (source.get('type') == 'embed' and k == 'url')}
-        for source in channel_data.get('sources', [])
+    return Response(compiled.api_json, mimetype='application/json')
+
+
+@app.get('/api/epg/now')
+def api_epg_now():
+    """Now/next for every channel with guide data, in one payload for the homepage."""
+    body, etag, max_age = epg_now_payload()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+
+@app.get('/api/epg/<channel>')
+@response_cache.cached(version=epg_version, vary=('hours',), max_age=60, ttl=60)
+def api_epg(channel):
+    """Return the programme on air, the next one and the schedule for the coming hours."""
+    compiled = compiled_channel(channel)
+    if compiled is None:
+        return {"error": "channel not found"}, 404
+    try:
+        hours = min(max(int(request.args.get('hours', 12)), 1), 48)
+    except ValueError:
+        return {"error": "invalid hours"}, 400
+    now = time.time()
+    current, upcoming = epg_guide.now_next(compiled.channel_id, now)
+    return {
+        'channel_id': compiled.channel_id,
+        'now': current,
+        'next': upcoming,
+        'programmes': epg_guide.programmes(compiled.channel_id, now, now + hours * 3600),
+    }, 200
+
+
+# Runtime counters listed on /admin/status.
+app.extensions['status'] = {
+    'response_cache': response_cache.stats,
+    'fragment_cache': fragment_cache.stats,
+    'channel_catalog': channel_catalog.stats,
+    'stream_health': stream_health.stats,
+    'hls_relay': hls_relay.stats,
+    'epg': epg_guide.stats,
+    'horoscope_cache': horoscope_cache.stats,
+    'click_store': click_store.stats,
+    'openrouter': openrouter.stats,
+    'horoscope_jobs': horoscope_jobs.stats,
+}
+
+# --- Static Export ---
+STATIC_EXPORT_DIR = os.getenv('STATIC_EXPORT_DIR') or os.path.join(DATA_DIR, 'site')
+
+
+def static_export_pages():
+    """(path, inputs) for the pages that only depend on the catalog, templates and config.
+
+    Must be called inside a request context. ``inputs`` of None means the
+    page is always re-rendered (its content comes from the database).
+    """
+    # The footer prints the year; any change to the views may change every page.
+    common = (SITE_NAME, BASE_URL, HLS_RELAY, datetime.now().year, os.stat(__file__).st_mtime_ns)
+
+    def page(path, template, *data):
+        return path, (common, fragment_cache.template_signature(template), data)
+
+    tab_templates = app.jinja_env.list_templates(filter_func=lambda name: name.startswith('tabs/'))
+    pages = [
+        (url_for('homepage'), (
+            common, channel_catalog.version,
+            [fragment_cache.template_signature(name) for name in ['homepage_new.html', *tab_templates]],
+        )),
+        page(url_for('privacy'), 'privacy.html'),
+        page(url_for('terms'), 'terms.html'),
+        page(url_for('contact'), 'contact.html'),
+        page(url_for('horoscope_list'), 'horoscope/list.html', ZODIAC_SIGNS),
+        page(url_for('horoscope_daily_page'), 'horoscope/daily.html'),
+        page(url_for('horoscope_birth_page'), 'horoscope/birth.html'),
     ]
-    return jsonify(public_data)
+    pages.extend(
+        page(url_for('horoscope_detail', sign=sign), 'horoscope/detail.html', sign, ZODIAC_SIGNS[sign], DAYS_OF_WEEK)
+        for sign in ZODIAC_SIGNS
+    )
+    for key in load_channels():
+        compiled = compiled_channel(key)
+        # A live page shows its channel, the related channels and the source picked for it.
+        source = compiled.select_source(None, stream_health.for_channel(compiled.channel_id))
+        pages.append(page(
+            url_for('live', channel=compiled.channel_id), 'live.html',
+            dict(compiled.data), [dict(c) for c in compiled.related], source and source.get('id'),
+        ))
+
+    pages.append((url_for('robots_txt'), None))
+    pages.append((url_for('sitemap'), None))
+    total = len(_sitemap_static_entries()) + reviews_stats()['count']
+    if total > sitemaps.MAX_URLS_PER_SITEMAP:
+        pages.extend(
+            (url_for('sitemap_page', page=n), None)
+            for n in range(1, -(-total // sitemaps.MAX_URLS_PER_SITEMAP) + 1)
+        )
+    return pages
+
+
+# --- CLI Commands ---
+@app.cli.command('backfill-review-tags')
+def backfill_review_tags_command():
+    """Rebuild the review_tags index from movie_reviews.tags."""
+    print(f"Processed {backfill_review_tags()} reviews.")
+
+
+@app.cli.command('check-streams')
+@click.option('--channel', default=None, help='Only check this channel id.')
+def check_streams_command(channel):
+    """Probe every embed source's HLS playlist and record its health."""
+    results = check_stream_sources(channel)
+    for r in sorted(results, key=lambda r: (r['channel_id'], r['source_id'])):
+        state = 'ok' if r['ok'] else 'FAIL'
+        ttfb = f"{r['ttfb_ms']} ms" if r['ttfb_ms'] is not None else '-'
+        print(f"{r['channel_id']}/{r['source_id']}: {state} {ttfb} {r['error'] or ''}".rstrip())
+    print(f"{sum(1 for r in results if r['ok'])} of {len(results)} sources healthy")
+
+
+@app.cli.command('refresh-epg')
+@click.option('--force', is_flag=True, help='Download even if the feed was fetched recently.')
+def refresh_epg_command(force):
+    """Download the XMLTV feed if it changed and report what was indexed."""
+    print(f"Refresh: {epg_guide.refresh(force=force)}")
+    epg_guide.load()
+    stats = epg_guide.stats()
+    print(f"{stats['programmes']} programmes for {stats['channels']} channels")
+    mapped = epg_guide.channel_ids()
+    missing = sorted(k for k in load_channels() if k not in mapped)
+    if missing:
+        print(f"No programmes for: {', '.join(missing)}")
+
+
+@app.cli.command('export-static')
+@click.option('--output', default=STATIC_EXPORT_DIR, show_default=True, help='Directory to write the site into.')
+@click.option('--force', is_flag=True, help='Re-render every page even if its inputs did not change.')
+def export_static_command(output, force):
+    """Pre-render the catalog, legal and horoscope pages plus sitemap and robots.txt."""
+    started = time.monotonic()
+    host = BASE_URL.split('://', 1)[-1]
+    with app.test_request_context(base_url=BASE_URL):
+        pages = static_export_pages()
+    client = app.test_client()
+    client.environ_base.update({'HTTP_HOST': host, 'wsgi.url_scheme': BASE_URL.split('://', 1)[0]})
+    report = export_site(client, output, pages, force=force)
+    elapsed_ms = int((time.monotonic() - started) * 1000)
+    print(f"{len(pages)} pages: {report['rendered']} rendered, {report['written']} written, "
+          f"{report['skipped']} unchanged inputs, {report['removed']} removed in {elapsed_ms} ms -> {output}")
+    for path in report['failed']:
+        print(f"  failed: {path}")
+
+
+@app.cli.command('warm-horoscopes')
+@click.option('--tomorrow', is_flag=True, help="Generate tomorrow's forecasts instead of today's.")
+@click.option('--concurrency', default=HOROSCOPE_WARM_CONCURRENCY, show_default=True,
+              help='Maximum parallel OpenRouter calls.')
+def warm_horoscopes_command(tomorrow, concurrency):
+    """Pre-generate the 12 sign forecasts and the daily/weekly horoscopes."""
+    period = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d') if tomorrow else None
+    report = warm_horoscopes(period, concurrency)
+    print(f"{report['period']}: {report['ok']} ok, {len(report['failed'])} failed in {report['elapsed_ms']} ms")
+    for name in report['failed']:
+        print(f"  failed: {name}")
+
+
+@app.cli.command('warm-birth-horoscopes')
+@click.option('--limit', default=0, help='Generate at most this many buckets (0 = all).')
+@click.option('--concurrency', default=HOROSCOPE_WARM_CONCURRENCY, show_default=True,
+              help='Maximum parallel OpenRouter calls.')
+def warm_birth_horoscopes_command(limit, concurrency):
+    """Pre-generate today's birthdate readings for every profile bucket (HOROSCOPE_BIRTH_MODE=bucket)."""
+    if HOROSCOPE_BIRTH_MODE != 'bucket':
+        print("HOROSCOPE_BIRTH_MODE is not 'bucket'; nothing to pre-generate.")
+        return
+    profiles = birth_bucket_profiles()
+    if limit:
+        profiles = profiles[:limit]
+    period = _today_period()
+    started = time.monotonic()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='horoscope-warm') as pool:
+        results = pool.map(
+            lambda profile: horoscope_cache.get_or_create(
+                'birth', birth_bucket_subject(profile), period, partial(_generate_birth_horoscope, profile),
+            ),
+            profiles,
+        )
+        for result in results:
+            if not isinstance(result, dict) or 'error' in result:
+                failed += 1
+    elapsed_ms = int((time.monotonic() - started) * 1000)
+    print(f"{period}: {len(profiles) - failed} ok, {failed} failed of {len(profiles)} buckets in {elapsed_ms} ms")
 
 
 # --- Main Execution ---
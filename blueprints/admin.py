@@ -1,12 +1,16 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, session, flash, jsonify
 from functools import wraps
+from itertools import islice
 from connect_db import db as dbutil
+from review_store import bulk_import_reviews, iter_json_array, parse_tags, search_reviews, set_review_tags
 import hmac
 import json
 import os
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+PREVIEW_LIMIT = 20
+
 
 def is_logged_in():
     return session.get('admin_logged_in') is True
@@ -49,6 +53,18 @@ def dashboard():
     return redirect(url_for('admin.reviews_list'))
 
 
+@bp.get('/status')
+@login_required
+def status():
+    data = {'db_pool': dbutil.pool_stats()}
+    for name, provider in current_app.extensions.get('status', {}).items():
+        try:
+            data[name] = provider()
+        except Exception as e:
+            data[name] = {'error': str(e)}
+    return jsonify(data)
+
+
 @bp.get('/reviews')
 @login_required
 def reviews_list():
@@ -57,21 +73,14 @@ def reviews_list():
     per_page = 12
     offset = (page - 1) * per_page
     if q:
-        rows = dbutil.sql_fetchall_params(
-            "SELECT id, title, slug, rating, published_at FROM movie_reviews WHERE title LIKE %s OR slug LIKE %s ORDER BY published_at DESC, id DESC LIMIT %s OFFSET %s",
-            (f"%{q}%", f"%{q}%", per_page, offset),
-        )
-        total_row = dbutil.sql_fetchone_params(
-            "SELECT COUNT(*) AS c FROM movie_reviews WHERE title LIKE %s OR slug LIKE %s",
-            (f"%{q}%", f"%{q}%"),
-        ) or {'c': 0}
+        rows, total = search_reviews(q, per_page, offset, match_slug=True)
     else:
         rows = dbutil.sql_fetchall_params(
             "SELECT id, title, slug, rating, published_at FROM movie_reviews ORDER BY published_at DESC, id DESC LIMIT %s OFFSET %s",
             (per_page, offset),
         )
         total_row = dbutil.sql_fetchone("SELECT COUNT(*) AS c FROM movie_reviews") or {'c': 0}
-    total = total_row.get('c', 0)
+        total = total_row.get('c', 0)
     return render_template('admin/reviews_list.html', items=rows or [], q=q, page=page, per_page=per_page, total=total)
 
 
@@ -90,7 +99,7 @@ def reviews_create():
             'published_at': request.form.get('published_at','').strip(),
         }
         # normalize
-        tags = ','.join([t.strip() for t in data['tags'].split(',') if t.strip()]) if data['tags'] else None
+        tags = parse_tags(data['tags'])
         try:
             body_json = json.dumps([p.strip() for p in data['body'].split('\n') if p.strip()], ensure_ascii=False)
             sql = (
@@ -99,10 +108,11 @@ def reviews_create():
             )
             params = (
                 data['title'], data['slug'], data['excerpt'], data['cover_image'] or None,
-                data['rating'], tags, body_json, data['published_at']
+                data['rating'], ','.join(tags) or None, body_json, data['published_at']
             )
-            if not dbutil.sql_commit(sql, params):
-                raise RuntimeError('database write failed')
+            with dbutil.transaction() as cur:
+                cur.execute(sql, params)
+                set_review_tags(cur, data['slug'], tags)
             flash('บันทึกเรียบร้อย', 'success')
             return redirect(url_for('admin.reviews_list'))
         except Exception as e:
@@ -126,13 +136,14 @@ def reviews_edit(slug):
             'body': request.form.get('body','').strip(),
             'published_at': request.form.get('published_at','').strip(),
         }
-        tags = ','.join([t.strip() for t in data['tags'].split(',') if t.strip()]) if data['tags'] else None
+        tags = parse_tags(data['tags'])
         body_json = json.dumps([p.strip() for p in data['body'].split('\n') if p.strip()], ensure_ascii=False)
         fields = ["title=%s","excerpt=%s","cover_image=%s","rating=%s","tags=%s","body=%s","published_at=%s"]
-        params = (data['title'], data['excerpt'], data['cover_image'] or None, data['rating'], tags, body_json, data['published_at'], slug)
+        params = (data['title'], data['excerpt'], data['cover_image'] or None, data['rating'], ','.join(tags) or None, body_json, data['published_at'], slug)
         try:
-            if not dbutil.sql_commit("UPDATE movie_reviews SET "+", ".join(fields)+" WHERE slug=%s", params):
-                raise RuntimeError('database write failed')
+            with dbutil.transaction() as cur:
+                cur.execute("UPDATE movie_reviews SET "+", ".join(fields)+" WHERE slug=%s", params)
+                set_review_tags(cur, slug, tags)
             flash('แก้ไขเรียบร้อย', 'success')
             return redirect(url_for('admin.reviews_list'))
         except Exception as e:
@@ -162,35 +173,24 @@ def reviews_delete(slug):
 @login_required
 def import_json():
     preview = None
+    report = None
     if request.method == 'POST':
         file = request.files.get('file')
         if not file:
             flash('กรุณาเลือกไฟล์ .json', 'warning')
         else:
             try:
-                payload = json.load(file)
-                preview = payload if isinstance(payload, list) else [payload]
+                items = iter_json_array(file.stream)
                 if request.form.get('confirm') == 'yes':
-                    inserted = 0
-                    for item in preview:
-                        try:
-                            sql = (
-                                "INSERT IGNORE INTO movie_reviews (title, slug, excerpt, cover_image, rating, tags, body, published_at) "
-                                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-                            )
-                            params = (
-                                item.get('title'), item.get('slug'), item.get('excerpt'), item.get('cover_image'),
-                                float(item.get('rating', 0) or 0),
-                                ','.join(item.get('tags', [])) if isinstance(item.get('tags'), list) else (item.get('tags') or None),
-                                json.dumps(item.get('body', []), ensure_ascii=False),
-                                item.get('published_at'),
-                            )
-                            if dbutil.sql_commit(sql, params):
-                                inserted += 1
-                        except Exception:
-                            continue
-                    flash(f'นำเข้า {inserted} รายการ', 'success')
-                    return redirect(url_for('admin.reviews_list'))
+                    report = bulk_import_reviews(items)
+                    summary = (f"นำเข้า {report['inserted']} รายการ ข้าม {report['skipped']} ล้มเหลว {report['failed']} "
+                               f"({report['elapsed_ms'] / 1000:.1f} วินาที)")
+                    if report['aborted']:
+                        flash(f"ไฟล์ JSON ผิดรูปแบบ หยุดนำเข้ากลางไฟล์: {report['aborted']} — {summary}", 'danger')
+                    else:
+                        flash(summary, 'success' if not report['failed'] else 'warning')
+                else:
+                    preview = list(islice(items, PREVIEW_LIMIT))
             except Exception as e:
                 flash(f'ไฟล์ไม่ถูกต้อง: {e}', 'danger')
-    return render_template('admin/import.html', preview=preview)
+    return render_template('admin/import.html', preview=preview, preview_limit=PREVIEW_LIMIT, report=report)
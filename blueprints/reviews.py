@@ -1,44 +1,195 @@
-from flask import Blueprint, render_template, request, jsonify, abort
+from flask import Blueprint, render_template, request, jsonify, abort, url_for
 from connect_db import db as dbutil
+from page_cache import response_cache
+from review_store import parse_tags, search_reviews, set_review_tags, tag_cloud
 import json
+import time
+from datetime import datetime
 
 bp = Blueprint('reviews', __name__)
 
+_VERSION_TTL = 5
+_version_cache = {'value': None, 'expires_at': 0.0}
+
+
+def reviews_stats():
+    """Row count and latest update of movie_reviews, memoised for a few seconds."""
+    now = time.monotonic()
+    if _version_cache['expires_at'] > now:
+        return _version_cache['value']
+    row = dbutil.sql_fetchone("SELECT COUNT(*) AS c, MAX(updated_at) AS u FROM movie_reviews") or {}
+    value = {'count': row.get('c') or 0, 'updated_at': row.get('u')}
+    _version_cache.update(value=value, expires_at=now + _VERSION_TTL)
+    return value
+
+
+def reviews_version():
+    """Cheap fingerprint of the movie_reviews table for cache keys."""
+    stats = reviews_stats()
+    return f"{stats['count']}:{stats['updated_at'] or ''}"
+
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+_LIST_COLUMNS = "id, title, slug, excerpt, cover_image, rating, published_at, tags"
+
+
+def encode_cursor(row):
+    """Opaque keyset cursor for the (published_at, id) position of ``row``."""
+    published_at = row.get('published_at')
+    return f"{published_at or 'none'}_{row['id']}"
+
+
+def decode_cursor(value):
+    """Parse a cursor from ``encode_cursor``. Raises ValueError if malformed."""
+    published, _, last_id = (value or '').rpartition('_')
+    if not published:
+        raise ValueError('invalid cursor')
+    if published == 'none':
+        return None, int(last_id)
+    return datetime.strptime(published, '%Y-%m-%d').date(), int(last_id)
+
+
+def fetch_review_page(cursor=None, tag=None, limit=PAGE_SIZE):
+    """Return (rows, next_cursor) for one page of reviews, newest first.
+
+    Uses keyset pagination on (published_at, id) so every page is a bounded
+    index range scan regardless of how deep the reader goes. Reviews without a
+    published_at sort last, as MySQL orders NULLs last in descending order.
+    """
+    where = []
+    params = []
+    if tag:
+        where.append("id IN (SELECT review_id FROM review_tags WHERE tag = %s)")
+        params.append(tag)
+    if cursor:
+        published_at, last_id = cursor
+        if published_at is None:
+            where.append("(published_at IS NULL AND id < %s)")
+            params.append(last_id)
+        else:
+            where.append("((published_at, id) < (%s, %s) OR published_at IS NULL)")
+            params.extend([published_at, last_id])
+    sql = f"SELECT {_LIST_COLUMNS} FROM movie_reviews"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY published_at DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
+    rows = dbutil.sql_fetchall_params(sql, tuple(params)) or []
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def _list_item(row):
+    item = dict(row)
+    try:
+        item['rating'] = float(item.get('rating') or 0)
+    except Exception:
+        item['rating'] = 0.0
+    if item.get('published_at') is not None:
+        item['published_at'] = str(item['published_at'])
+    # Prepare tags list
+    tags_val = item.get('tags')
+    if isinstance(tags_val, str):
+        item['tags_list'] = [t.strip() for t in tags_val.split(',') if t.strip()]
+    else:
+        item['tags_list'] = []
+    return item
+
+
+def _page_args():
+    tag = request.args.get('tag', '').strip()
+    cursor_arg = request.args.get('cursor', '').strip()
+    try:
+        cursor = decode_cursor(cursor_arg) if cursor_arg else None
+    except ValueError:
+        abort(400)
+    return tag, cursor
+
 
 @bp.route('/')
 @bp.route('/movies')
+@response_cache.cached(version=reviews_version, vary=('tag', 'cursor'))
 def list_movies():
-    tag = request.args.get('tag', '').strip()
-    if tag:
-        # Filter by tag (comma separated) using LIKE on wrapped string
-        like_val = f"%,{tag},%"
-        rows = dbutil.sql_fetchall_params(
-            "SELECT title, slug, excerpt, cover_image, rating, published_at, tags FROM movie_reviews "
-            "WHERE tags IS NOT NULL AND CONCAT(',', REPLACE(tags, ' ', ''), ',') LIKE %s "
-            "ORDER BY published_at DESC, id DESC",
-            (like_val,),
-        )
-    else:
-        rows = dbutil.sql_fetchall(
-            "SELECT title, slug, excerpt, cover_image, rating, published_at, tags FROM movie_reviews ORDER BY published_at DESC, id DESC"
-        )
-    reviews = []
-    for r in rows or []:
-        item = dict(r)
-        try:
-            item['rating'] = float(item.get('rating') or 0)
-        except Exception:
-            item['rating'] = 0.0
-        if item.get('published_at') is not None:
-            item['published_at'] = str(item['published_at'])
-        # Prepare tags list
-        tags_val = item.get('tags')
-        if isinstance(tags_val, str):
-            item['tags_list'] = [t.strip() for t in tags_val.split(',') if t.strip()]
-        else:
-            item['tags_list'] = []
-        reviews.append(item)
-    return render_template('reviews/list.html', reviews=reviews, category='movies', selected_tag=tag)
+    tag, cursor = _page_args()
+    rows, next_cursor = fetch_review_page(cursor, tag)
+    reviews = [_list_item(r) for r in rows]
+    tag_arg = tag or None
+    return render_template(
+        'reviews/list.html', reviews=reviews, category='movies', selected_tag=tag,
+        next_url=url_for('reviews.list_movies', tag=tag_arg, cursor=next_cursor) if next_cursor else None,
+        first_url=url_for('reviews.list_movies', tag=tag_arg) if cursor else None,
+    )
+
+
+def _search_args():
+    q = request.args.get('q', '').strip()
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        abort(400)
+    return q, page
+
+
+@bp.get('/search')
+@response_cache.cached(version=reviews_version, vary=('q', 'page'))
+def search():
+    q, page = _search_args()
+    rows, total = search_reviews(q, PAGE_SIZE, (page - 1) * PAGE_SIZE)
+    reviews = [_list_item(r) for r in rows]
+    has_next = page * PAGE_SIZE < total
+    return render_template(
+        'reviews/list.html', reviews=reviews, category='movies', selected_tag='', q=q, total=total,
+        next_url=url_for('reviews.search', q=q, page=page + 1) if has_next else None,
+        first_url=url_for('reviews.search', q=q) if page > 1 else None,
+    )
+
+
+@bp.get('/api/search')
+def api_search():
+    q, page = _search_args()
+    try:
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "invalid limit"}), 400
+    rows, total = search_reviews(q, limit, (page - 1) * limit)
+    items = []
+    for r in rows:
+        item = _list_item(r)
+        for key in ('id', 'total'):
+            item.pop(key, None)
+        item['score'] = float(item.get('score') or 0)
+        item['tags'] = item.pop('tags_list')
+        items.append(item)
+    return jsonify({"q": q, "page": page, "total": total, "items": items})
+
+
+@bp.get('/api/tags')
+@response_cache.cached(version=reviews_version, vary=('limit',), max_age=300)
+def api_tags():
+    """Tag cloud: the most used review tags with their review counts."""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+    except ValueError:
+        return jsonify({"error": "invalid limit"}), 400
+    return jsonify({"tags": tag_cloud(limit)})
+
+
+@bp.get('/api/reviews/movies')
+def api_list_movie_reviews():
+    tag, cursor = _page_args()
+    try:
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "invalid limit"}), 400
+    rows, next_cursor = fetch_review_page(cursor, tag, limit)
+    items = []
+    for r in rows:
+        item = _list_item(r)
+        item.pop('id', None)
+        item['tags'] = item.pop('tags_list')
+        items.append(item)
+    return jsonify({"items": items, "next_cursor": next_cursor})
 
 
 @bp.route('/movies/<slug>')
@@ -74,19 +225,21 @@ def api_create_movie_review():
         "INSERT INTO movie_reviews (title, slug, excerpt, cover_image, rating, tags, body, published_at) "
         "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
     )
+    tags = parse_tags(data.get('tags'))
     params = (
         data.get('title'),
         data.get('slug'),
         data.get('excerpt'),
         data.get('cover_image'),
         float(data.get('rating', 0)),
-        ','.join(data.get('tags', [])) if isinstance(data.get('tags'), list) else (data.get('tags') or None),
+        ','.join(tags) or None,
         json.dumps(data.get('body', []), ensure_ascii=False),
         data.get('published_at'),
     )
     try:
-        if not dbutil.sql_commit(sql, params):
-            return jsonify({"error": "database write failed"}), 400
+        with dbutil.transaction() as cur:
+            cur.execute(sql, params)
+            set_review_tags(cur, data.get('slug'), tags)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
     return jsonify({"status": "created", "slug": data.get('slug')}), 201
@@ -102,8 +255,8 @@ def api_update_movie_review(slug):
             fields.append(f"{key}=%s")
             if key == 'rating':
                 params.append(float(data[key]))
-            elif key == 'tags' and isinstance(data[key], list):
-                params.append(','.join(data[key]))
+            elif key == 'tags':
+                params.append(','.join(parse_tags(data[key])) or None)
             elif key == 'body' and isinstance(data[key], list):
                 params.append(json.dumps(data[key], ensure_ascii=False))
             else:
@@ -113,8 +266,10 @@ def api_update_movie_review(slug):
     sql = "UPDATE movie_reviews SET " + ", ".join(fields) + " WHERE slug=%s"
     params.append(slug)
     try:
-        if not dbutil.sql_commit(sql, tuple(params)):
-            return jsonify({"error": "database write failed"}), 400
+        with dbutil.transaction() as cur:
+            cur.execute(sql, tuple(params))
+            if 'tags' in data:
+                set_review_tags(cur, slug, parse_tags(data['tags']))
     except Exception as e:
         return jsonify({"error": str(e)}), 400
     return jsonify({"status": "updated"})
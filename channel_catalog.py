@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from stream_health import rank_sources
+
+
+@dataclass(frozen=True)
+class CompiledChannel:
+    """Per-channel values derived from the catalog that the live pages need."""
+
+    channel_id: str
+    data: MappingProxyType
+    embed_sources: tuple
+    embed_by_id: MappingProxyType
+    default_source: dict | None
+    external_sources: tuple
+    related: tuple
+    seo: MappingProxyType
+    canonical_url: str
+    api_json: bytes
+
+    def select_source(self, source_id=None, health=None):
+        """Return the requested embed source, falling back to the best one.
+
+        ``health`` maps source ids to stream health results; without it the
+        default (primary) source is used.
+        """
+        if source_id:
+            source = self.embed_by_id.get(source_id)
+            if source is not None:
+                return source
+        if health and self.embed_sources:
+            return rank_sources(self.embed_sources, health)[0]
+        return self.default_source
+
+
+class CatalogSnapshot:
+    """Immutable view of one parsed version of the channels file.
+
+    Readers must treat ``channels`` as read-only; a reload swaps in a whole new
+    snapshot instead of mutating this one. Values computed from the channels
+    (compiled views, rendered fragments, ...) are memoised per snapshot via
+    ``derive()`` so they are rebuilt exactly once per catalog version.
+    """
+
+    __slots__ = ('channels', 'version', 'loaded_at', 'modified_at', '_derived', '_lock')
+
+    def __init__(self, channels, version, loaded_at, modified_at=None):
+        self.channels = channels
+        self.version = version
+        self.loaded_at = loaded_at
+        self.modified_at = modified_at
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def derive(self, name, builder):
+        """Return ``builder(channels)``, computed once for this snapshot."""
+        try:
+            return self._derived[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = builder(self.channels)
+            return self._derived[name]
+
+
+class ChannelCatalog:
+    """Process-wide channel catalog that re-parses the JSON file only when it changes.
+
+    The file is stat()ed at most once per ``check_interval`` seconds; a new
+    snapshot is built when its mtime, inode or size differ from the last load.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.reload_count = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._snapshot = CatalogSnapshot({}, '', None)
+        self._signature = None
+        self._checked_at = 0.0
+        self._listeners = []
+
+    def snapshot(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._refresh(now)
+        return self._snapshot
+
+    def channels(self):
+        return self.snapshot().channels
+
+    def get(self, channel_id):
+        return self.snapshot().channels.get((channel_id or '').lower())
+
+    @property
+    def version(self):
+        return self.snapshot().version
+
+    def subscribe(self, callback):
+        """Call ``callback(snapshot)`` whenever a new version of the file is loaded."""
+        self._listeners.append(callback)
+
+    def stats(self):
+        snapshot = self.snapshot()
+        return {
+            'path': self.path,
+            'version': snapshot.version,
+            'channels': len(snapshot.channels),
+            'reload_count': self.reload_count,
+            'loaded_at': snapshot.loaded_at,
+            'last_error': self.last_error,
+        }
+
+    def _refresh(self, now):
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+            except OSError as e:
+                self._record_error(e)
+                return
+            signature = (st.st_mtime_ns, st.st_ino, st.st_size)
+            if signature == self._signature:
+                return
+            try:
+                with open(self.path, 'rb') as f:
+                    raw = f.read()
+                items = json.loads(raw.decode('utf-8'))
+            except Exception as e:
+                # Keep serving the last good snapshot; retry on the next change.
+                self._signature = signature
+                self._record_error(e)
+                return
+            channels = {
+                item['channel_id'].lower(): item
+                for item in items if isinstance(item, dict) and item.get('channel_id')
+            }
+            self._snapshot = CatalogSnapshot(
+                channels,
+                hashlib.sha1(raw).hexdigest()[:12],
+                time.time(),
+                st.st_mtime,
+            )
+            self._signature = signature
+            self.reload_count += 1
+            self.last_error = None
+            logging.info("Loaded %d channels from %s (version %s)",
+                         len(channels), self.path, self._snapshot.version)
+            for callback in self._listeners:
+                try:
+                    callback(self._snapshot)
+                except Exception:
+                    logging.exception("Channel catalog reload listener failed")
+
+    def _record_error(self, error):
+        self.last_error = str(error)
+        logging.error("Could not load channels data: %s", error)
@@ -1,27 +1,52 @@
+import json
+import os
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
 
 import requests
-import xml.etree.ElementTree as ET
-import sys
+
+from epg import parse_xmltv
 
 # Force encoding for Windows console
 sys.stdout.reconfigure(encoding='utf-8')
 
-url = 'https://akkradet.github.io/IPTV-THAI/guide.xml'
-print(f"Fetching {url}...")
+source = sys.argv[1] if len(sys.argv) > 1 else 'https://akkradet.github.io/IPTV-THAI/guide.xml'
+channels_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'channels.json')
+
+path = source
+tmp_path = None
 try:
-    r = requests.get(url, timeout=10)
-    r.encoding = 'utf-8' # Ensure utf-8
-    print(f"Status: {r.status_code}")
-    
-    root = ET.fromstring(r.text)
-    
+    if source.startswith(('http://', 'https://')):
+        print(f"Fetching {source}...")
+        with requests.get(source, timeout=30, stream=True) as r:
+            print(f"Status: {r.status_code}")
+            r.raise_for_status()
+            with tempfile.NamedTemporaryFile(suffix='.xml', delete=False) as f:
+                tmp_path = path = f.name
+                for chunk in r.iter_content(65536):
+                    f.write(chunk)
+
     print("\nAvailable Channels:")
     print("-" * 30)
-    for channel in root.findall('channel'):
-        cid = channel.get('id')
-        name = channel.find('display-name').text
-        print(f"{cid} : {name}")
+    for _, elem in ET.iterparse(path):
+        if elem.tag == 'channel':
+            print(f"{elem.get('id')} : {elem.findtext('display-name')}")
+        if elem.tag in ('channel', 'programme'):
+            elem.clear()
     print("-" * 30)
-    
+
+    with open(channels_file, encoding='utf-8') as f:
+        channels = {c['channel_id'].lower(): c for c in json.load(f) if c.get('channel_id')}
+    schedules = parse_xmltv(path, channels, 0)
+    print("\nCatalog channels with programmes:")
+    for channel_id, schedule in sorted(schedules.items()):
+        print(f"{channel_id} : {len(schedule)} programmes")
+    missing = sorted(set(channels) - set(schedules))
+    print(f"\nNo programmes ({len(missing)}), add an epg_id to map them: {', '.join(missing)}")
+
 except Exception as e:
     print(f"Error: {e}")
+finally:
+    if tmp_path:
+        os.remove(tmp_path)
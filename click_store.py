@@ -0,0 +1,199 @@
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Rolling ranking windows in seconds; None means all-time totals.
+WINDOWS = {'1h': 3600, '24h': 86400, '7d': 7 * 86400, 'all': None}
+BUCKET_SECONDS = 300
+_RETENTION_SECONDS = max(w for w in WINDOWS.values() if w) + BUCKET_SECONDS
+_PRUNE_INTERVAL = 3600
+
+
+class ClickStore:
+    """Channel click counters in SQLite, fed by batched in-process increments.
+
+    ``record()`` only bumps an in-memory counter; a background thread flushes
+    the accumulated deltas every ``flush_interval`` seconds (or sooner once
+    ``max_pending`` clicks are buffered) as a single upsert transaction. SQLite
+    serialises writers across gunicorn workers, so increments are never lost
+    to read-modify-write races.
+
+    Besides all-time totals, clicks are counted in ``BUCKET_SECONDS`` time
+    buckets (kept for the longest window) so ``top()`` can rank the last
+    hour, day or week by summing a bounded range of buckets.
+    """
+
+    def __init__(self, path, flush_interval=2.0, max_pending=1000, legacy_json_path=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.legacy_json_path = legacy_json_path
+        self.flushes = 0
+        self.flush_errors = 0
+        self._pending = {}
+        self._pending_count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread_pid = None
+        self._initialized = False
+        self._pruned_at = 0.0
+        atexit.register(self.flush)
+
+    def record(self, name, logo='', link=''):
+        key = (name, int(time.time()) // BUCKET_SECONDS)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [1, logo, link]
+            else:
+                entry[0] += 1
+            self._pending_count += 1
+            flush_now = self._pending_count >= self.max_pending
+        self._ensure_flusher()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """Write buffered increments to the database. Returns the number of clicks written."""
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            count, self._pending_count = self._pending_count, 0
+        totals = {}
+        for (name, _), (clicks, logo, link) in pending.items():
+            total = totals.setdefault(name, [0, logo, link])
+            total[0] += clicks
+        try:
+            with self._flush_lock, self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO channel_clicks (name, logo, link, clicks) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET clicks = clicks + excluded.clicks",
+                    [(name, logo, link, clicks) for name, (clicks, logo, link) in totals.items()],
+                )
+                conn.executemany(
+                    "INSERT INTO channel_click_buckets (name, bucket, clicks) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name, bucket) DO UPDATE SET clicks = clicks + excluded.clicks",
+                    [(name, bucket, clicks) for (name, bucket), (clicks, _, _) in pending.items()],
+                )
+                self._prune(conn)
+            self.flushes += 1
+            return count
+        except Exception:
+            self.flush_errors += 1
+            logging.exception("Could not flush channel clicks; keeping them for the next attempt")
+            with self._lock:
+                for key, (clicks, logo, link) in pending.items():
+                    entry = self._pending.setdefault(key, [0, logo, link])
+                    entry[0] += clicks
+                self._pending_count += count
+            return 0
+
+    def top(self, limit=10, window='all'):
+        """Most clicked channels overall or within one of ``WINDOWS``."""
+        seconds = WINDOWS[window]
+        with self._connect() as conn:
+            if seconds is None:
+                rows = conn.execute(
+                    "SELECT name, logo, link, clicks FROM channel_clicks ORDER BY clicks DESC LIMIT ?",
+                    (limit,),
+                ).fetchall()
+            else:
+                since = (int(time.time()) - seconds) // BUCKET_SECONDS + 1
+                rows = conn.execute(
+                    "SELECT b.name, c.logo, c.link, SUM(b.clicks) AS clicks "
+                    "FROM channel_click_buckets b JOIN channel_clicks c ON c.name = b.name "
+                    "WHERE b.bucket >= ? GROUP BY b.name ORDER BY clicks DESC LIMIT ?",
+                    (since, limit),
+                ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self):
+        return {
+            'pending': self._pending_count,
+            'flushes': self.flushes,
+            'flush_errors': self.flush_errors,
+        }
+
+    @contextmanager
+    def _connect(self):
+        """Yield a connection that commits on success and is always closed."""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.row_factory = sqlite3.Row
+            if not self._initialized:
+                self._initialize(conn)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _initialize(self, conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS channel_clicks ("
+                " name TEXT PRIMARY KEY, logo TEXT, link TEXT, clicks INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_channel_clicks_clicks ON channel_clicks (clicks)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS channel_click_buckets ("
+                " name TEXT NOT NULL, bucket INTEGER NOT NULL, clicks INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (name, bucket))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_channel_click_buckets_bucket ON channel_click_buckets (bucket)")
+        self._import_legacy_json(conn)
+        self._initialized = True
+
+    def _import_legacy_json(self, conn):
+        """One-off migration from the old channel_clicks.json file."""
+        if not self.legacy_json_path or not os.path.isfile(self.legacy_json_path):
+            return
+        if conn.execute("SELECT 1 FROM channel_clicks LIMIT 1").fetchone():
+            return
+        try:
+            with open(self.legacy_json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logging.error("Could not read legacy clicks file: %s", e)
+            return
+        rows = [
+            (key, item.get('logo', ''), item.get('link', ''), int(item.get('clicks', 0)))
+            for key, item in data.items() if isinstance(item, dict)
+        ]
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO channel_clicks (name, logo, link, clicks) VALUES (?, ?, ?, ?)", rows,
+            )
+        logging.info("Imported %d channel click counters from %s", len(rows), self.legacy_json_path)
+
+    def _prune(self, conn):
+        now = time.time()
+        if now - self._pruned_at < _PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        conn.execute(
+            "DELETE FROM channel_click_buckets WHERE bucket < ?",
+            ((int(now) - _RETENTION_SECONDS) // BUCKET_SECONDS,),
+        )
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            self._thread_pid = pid
+        threading.Thread(target=self._run_flusher, name='click-flusher', daemon=True).start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
@@ -1,7 +1,23 @@
 import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
 
 import pymysql
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', '5'))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))
+POOL_MAX_IDLE = int(os.getenv('DB_POOL_MAX_IDLE', '300'))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pool_counters = {'connects': 0, 'checkouts': 0, 'ping_failures': 0, 'idle_discards': 0}
 
 
 def _connect():
@@ -25,6 +41,64 @@ def _connect():
     )
 
 
+def _on_connect(dbapi_connection, connection_record):
+    _pool_counters['connects'] += 1
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    if dbapi_connection is not None:
+        connection_record.info['checked_in_at'] = time.monotonic()
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    _pool_counters['checkouts'] += 1
+    checked_in_at = connection_record.info.pop('checked_in_at', None)
+    if checked_in_at is None:
+        return
+    if time.monotonic() - checked_in_at > POOL_MAX_IDLE:
+        _pool_counters['idle_discards'] += 1
+        raise exc.DisconnectionError("connection idle for too long")
+    try:
+        dbapi_connection.ping(reconnect=False)
+    except Exception as e:
+        _pool_counters['ping_failures'] += 1
+        raise exc.DisconnectionError(f"ping failed: {e}")
+
+
+def _get_pool():
+    """Return this process's connection pool, creating it after a fork if needed."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                # A pool inherited from the parent shares its sockets; drop it without closing.
+                pool = QueuePool(
+                    _connect,
+                    pool_size=POOL_SIZE,
+                    max_overflow=POOL_MAX_OVERFLOW,
+                    timeout=POOL_TIMEOUT,
+                    recycle=POOL_RECYCLE,
+                )
+                event.listen(pool, 'connect', _on_connect)
+                event.listen(pool, 'checkin', _on_checkin)
+                event.listen(pool, 'checkout', _on_checkout)
+                _pool, _pool_pid = pool, pid
+    return _pool
+
+
+@contextmanager
+def _connection():
+    conn = _get_pool().connect()
+    try:
+        yield conn
+    except pymysql.err.OperationalError:
+        conn.invalidate()
+        raise
+    finally:
+        conn.close()
+
+
 class db:
     @staticmethod
     def sql_fetchall(sql):
@@ -37,7 +111,7 @@ class db:
     @staticmethod
     def sql_fetchone_params(sql, params):
         try:
-            with _connect() as conn:
+            with _connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(sql, params)
                     return cur.fetchone()
@@ -48,7 +122,7 @@ class db:
     @staticmethod
     def sql_fetchall_params(sql, params):
         try:
-            with _connect() as conn:
+            with _connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(sql, params)
                     return cur.fetchall()
@@ -56,10 +130,30 @@ class db:
             logging.exception("Database fetchall failed")
             return []
 
+    @staticmethod
+    def sql_iter_params(sql, params, batch_size=1000):
+        """Yield rows one by one from an unbuffered cursor, without loading the full result.
+
+        Errors are logged and re-raised: a caller that streams the rows must not
+        mistake a result cut short by a failure for a complete one.
+        """
+        try:
+            with _connection() as conn:
+                with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
+                    cur.execute(sql, params)
+                    while True:
+                        rows = cur.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        yield from rows
+        except Exception:
+            logging.exception("Database iterate failed")
+            raise
+
     @staticmethod
     def sql_commit(sql, params=None):
         try:
-            with _connect() as conn:
+            with _connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(sql, params)
                 conn.commit()
@@ -72,6 +166,31 @@ class db:
     def sql_run_commit(sql):
         return db.sql_commit(sql)
 
+    @staticmethod
+    @contextmanager
+    def transaction():
+        """Yield a cursor whose statements commit together; rolls back and re-raises on error."""
+        with _connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    yield cur
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def pool_stats():
+        pool = _get_pool()
+        return {
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'max_overflow': POOL_MAX_OVERFLOW,
+            **_pool_counters,
+        }
+
 
 class share:
     @staticmethod
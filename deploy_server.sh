@@ -44,12 +44,19 @@ docker load -i "$IMAGE_TAR"
 echo "Stopping old container if exists ..."
 docker rm -f "$APP_NAME" >/dev/null 2>&1 || true
 
+# Runtime state (click counters, caches) lives in ./var. An old
+# channel_clicks.json is imported from there on first start.
+mkdir -p var
+if [ -f channel_clicks.json ] && [ ! -e var/channel_clicks.json ]; then
+  cp channel_clicks.json var/channel_clicks.json
+fi
+
 echo "Starting $APP_NAME on port $HOST_PORT ..."
 docker run -d \
   --name "$APP_NAME" \
   --env-file "$ENV_FILE" \
   -p "$HOST_PORT:$CONTAINER_PORT" \
-  -v "$(pwd)/channel_clicks.json:/app/channel_clicks.json" \
+  -v "$(pwd)/var:/app/var" \
   --restart unless-stopped \
   "$IMAGE_TAG"
 
@@ -0,0 +1,373 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timezone
+
+import requests
+
+# Descriptions are only shown as a teaser; cap them to keep the index small.
+_MAX_DESC_CHARS = 300
+
+
+class ChannelSchedule:
+    """One channel's programmes sorted by start time.
+
+    Start and stop times are kept in flat ``array('q')`` columns next to a
+    tuple of (title, desc, category), so a lookup is a bisect over the starts.
+    """
+
+    __slots__ = ('starts', 'stops', 'items')
+
+    def __init__(self, programmes):
+        programmes.sort(key=lambda p: p[0])
+        self.starts = array('q', (p[0] for p in programmes))
+        self.stops = array('q', (p[1] for p in programmes))
+        self.items = tuple(p[2:] for p in programmes)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def now_next(self, at):
+        """Return (now, next) programme dicts at epoch second ``at``."""
+        index = bisect_right(self.starts, at) - 1
+        current = None
+        if index >= 0 and self.stops[index] > at:
+            current = self.programme(index)
+        upcoming = self.programme(index + 1) if index + 1 < len(self.starts) else None
+        return current, upcoming
+
+    def between(self, start, end):
+        """Return programmes that overlap [start, end)."""
+        index = max(bisect_right(self.starts, start) - 1, 0)
+        result = []
+        while index < len(self.starts) and self.starts[index] < end:
+            if self.stops[index] > start:
+                result.append(self.programme(index))
+            index += 1
+        return result
+
+    def programme(self, index):
+        title, desc, category = self.items[index]
+        return {
+            'title': title,
+            'start': _isoformat(self.starts[index]),
+            'stop': _isoformat(self.stops[index]),
+            'desc': desc,
+            'category': category,
+        }
+
+
+class EpgGuide:
+    """Programme guide for the catalog's channels, built from an XMLTV feed.
+
+    ``source`` is an http(s) URL or a local XMLTV file. ``refresh()``
+    downloads a URL to ``cache_path`` with a conditional request (ETag /
+    If-Modified-Since), so an unchanged feed is neither transferred nor
+    re-parsed. The file is parsed incrementally with ``iterparse`` and only
+    programmes of channels in the catalog are kept.
+
+    XMLTV channel ids map to ``channel_id`` through a channel's ``epg_id``
+    field, falling back to matching ids and display names against the
+    catalog. Readers never wait for a parse: like ``ChannelCatalog``, the file
+    is stat()ed at most once per ``check_interval`` seconds, and a changed
+    file is re-parsed in a background thread while the previous guide keeps
+    being served.
+    """
+
+    def __init__(self, source, cache_path, channels_func, refresh_interval=3600, check_interval=30,
+                 timeout=30, keep_past=6 * 3600):
+        self.source = source
+        self.is_remote = source.startswith(('http://', 'https://'))
+        self.path = cache_path if self.is_remote else source
+        self.channels_func = channels_func
+        self.refresh_interval = refresh_interval
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.keep_past = keep_past
+        self.reload_count = 0
+        self.last_error = None
+        self.last_refresh = None
+        self._schedules = {}
+        self._version = ''
+        self._loaded_at = None
+        self._signature = None
+        self._checked_at = 0.0
+        self._reloading = False
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        self._current()
+        return self._version
+
+    def invalidate(self):
+        """Re-parse on the next lookup, e.g. after the channel catalog changed."""
+        self._signature = None
+        self._checked_at = 0.0
+
+    def now_next(self, channel_id, at=None):
+        schedule = self._current().get((channel_id or '').lower())
+        if schedule is None:
+            return None, None
+        return schedule.now_next(int(at if at is not None else time.time()))
+
+    def programmes(self, channel_id, start, end):
+        schedule = self._current().get((channel_id or '').lower())
+        return schedule.between(int(start), int(end)) if schedule is not None else []
+
+    def now_next_all(self, channel_ids, at):
+        """Return {channel_id: {'now': ..., 'next': ...}} with titles and times only, for channels on air."""
+        schedules = self._current()
+        result = {}
+        for channel_id in channel_ids:
+            schedule = schedules.get(channel_id.lower())
+            if schedule is None:
+                continue
+            current, upcoming = schedule.now_next(int(at))
+            if current is None and upcoming is None:
+                continue
+            result[channel_id] = {
+                'now': _brief(current),
+                'next': _brief(upcoming),
+            }
+        return result
+
+    def channel_ids(self):
+        """Catalog channel ids that have programmes in the guide."""
+        return set(self._current())
+
+    def refresh(self, force=False):
+        """Download the feed if it changed; returns 'updated', 'not-modified', 'skipped' or 'error'."""
+        if not self.is_remote:
+            return 'skipped'
+        meta = self._read_meta()
+        # Every worker may call this; skip when another one fetched recently.
+        if not force and time.time() - meta.get('fetched_at', 0) < self.refresh_interval / 2:
+            return 'skipped'
+        headers = {}
+        if os.path.exists(self.path):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            with requests.get(self.source, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304:
+                    outcome = 'not-modified'
+                else:
+                    response.raise_for_status()
+                    tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in response.iter_content(65536):
+                            f.write(chunk)
+                    os.replace(tmp_path, self.path)
+                    meta['etag'] = response.headers.get('ETag')
+                    meta['last_modified'] = response.headers.get('Last-Modified')
+                    outcome = 'updated'
+        except (requests.RequestException, OSError) as e:
+            logging.error("EPG download from %s failed: %s", self.source, e)
+            self.last_error = str(e)
+            return 'error'
+        meta['fetched_at'] = time.time()
+        self._write_meta(meta)
+        self.last_refresh = {'outcome': outcome, 'at': meta['fetched_at']}
+        logging.info("EPG refresh from %s: %s", self.source, outcome)
+        return outcome
+
+    def load(self):
+        """Parse the guide file now, in the calling thread. Returns the number of programmes kept."""
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            self.last_error = str(e)
+            return 0
+        signature = (st.st_mtime_ns, st.st_ino, st.st_size)
+        started = time.monotonic()
+        try:
+            schedules = parse_xmltv(self.path, self.channels_func(), time.time() - self.keep_past)
+        except (ET.ParseError, OSError) as e:
+            # Keep serving the last good guide; retry on the next change.
+            logging.error("Could not parse EPG file %s: %s", self.path, e)
+            self._signature = signature
+            self.last_error = str(e)
+            if self.is_remote:
+                self._forget_validators()
+            return 0
+        self._schedules = schedules
+        self._version = f"{st.st_mtime_ns:x}-{self.reload_count + 1}"
+        self._loaded_at = time.time()
+        self._signature = signature
+        self.reload_count += 1
+        self.last_error = None
+        total = sum(len(s) for s in schedules.values())
+        logging.info("Loaded EPG for %d channels (%d programmes) in %d ms",
+                     len(schedules), total, int((time.monotonic() - started) * 1000))
+        return total
+
+    def start_scheduler(self):
+        """Refresh the feed every ``refresh_interval`` seconds in a daemon thread."""
+        def loop():
+            while True:
+                try:
+                    self.refresh()
+                except Exception:
+                    logging.exception("EPG refresh failed")
+                time.sleep(self.refresh_interval)
+        threading.Thread(target=loop, name='epg-refresh', daemon=True).start()
+
+    def stats(self):
+        schedules = self._current()
+        return {
+            'source': self.source,
+            'version': self._version,
+            'channels': len(schedules),
+            'programmes': sum(len(s) for s in schedules.values()),
+            'loaded_at': self._loaded_at,
+            'reload_count': self.reload_count,
+            'last_refresh': self.last_refresh,
+            'last_error': self.last_error,
+        }
+
+    def _current(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+                changed = (st.st_mtime_ns, st.st_ino, st.st_size) != self._signature
+            except OSError:
+                changed = False
+            if changed:
+                self._reload_in_background()
+        return self._schedules
+
+    def _reload_in_background(self):
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+
+        def run():
+            try:
+                self.load()
+            except Exception:
+                logging.exception("EPG reload failed")
+            finally:
+                with self._lock:
+                    self._reloading = False
+        threading.Thread(target=run, name='epg-reload', daemon=True).start()
+
+    def _read_meta(self):
+        try:
+            with open(self.path + '.json', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _forget_validators(self):
+        """Drop the stored ETag / Last-Modified so the next refresh downloads the whole feed.
+
+        Otherwise the origin would answer 304 and the unparseable file would stay.
+        """
+        meta = self._read_meta()
+        if meta.get('etag') or meta.get('last_modified'):
+            meta.pop('etag', None)
+            meta.pop('last_modified', None)
+            self._write_meta(meta)
+
+    def _write_meta(self, meta):
+        try:
+            with open(self.path + '.json', 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        except OSError as e:
+            logging.error("Could not save EPG metadata: %s", e)
+
+
+def parse_xmltv(path, channels, keep_after):
+    """Return {channel_id: ChannelSchedule} for catalog ``channels`` from an XMLTV file.
+
+    Programmes that ended before ``keep_after`` (epoch seconds) are dropped.
+    Elements are discarded as soon as they are read, so memory stays bounded
+    by the programmes kept.
+    """
+    explicit, by_name = _channel_lookup(channels)
+    mapping = dict(explicit)
+    programmes = {}
+    context = ET.iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event != 'end' or elem.tag not in ('channel', 'programme'):
+            continue
+        if elem.tag == 'channel':
+            xml_id = elem.get('id')
+            if xml_id and xml_id not in mapping:
+                names = [xml_id, xml_id.split('.')[0]] + [n.text or '' for n in elem.findall('display-name')]
+                channel_id = next((by_name[k] for k in map(_normalize, names) if k in by_name), None)
+                if channel_id:
+                    mapping[xml_id] = channel_id
+        else:
+            channel_id = mapping.get(elem.get('channel'))
+            start = _parse_time(elem.get('start'))
+            stop = _parse_time(elem.get('stop'))
+            if channel_id and start is not None and stop is not None and stop > keep_after:
+                desc = (elem.findtext('desc') or '').strip()
+                programmes.setdefault(channel_id, []).append((
+                    start, stop,
+                    (elem.findtext('title') or '').strip(),
+                    desc[:_MAX_DESC_CHARS],
+                    (elem.findtext('category') or '').strip() or None,
+                ))
+        root.clear()
+    return {channel_id: ChannelSchedule(items) for channel_id, items in programmes.items()}
+
+
+def _channel_lookup(channels):
+    """Return ({epg_id: channel_id}, {normalized id or name: channel_id}) for the catalog."""
+    explicit = {}
+    by_name = {}
+    for key, channel in channels.items():
+        epg_ids = channel.get('epg_id') or []
+        for epg_id in [epg_ids] if isinstance(epg_ids, str) else epg_ids:
+            explicit[epg_id] = key
+        for name in (key, channel.get('name') or ''):
+            normalized = _normalize(name)
+            if normalized:
+                by_name.setdefault(normalized, key)
+    return explicit, by_name
+
+
+def _normalize(name):
+    name = re.sub(r'[\W_]+', '', name.lower())
+    return name[:-2] if name.endswith('hd') and len(name) > 2 else name
+
+
+def _parse_time(value):
+    """Parse an XMLTV timestamp ("20250131183000 +0700") to epoch seconds; no offset means UTC."""
+    if not value:
+        return None
+    parts = value.split()
+    try:
+        when = datetime.strptime(parts[0][:14], '%Y%m%d%H%M%S')
+        if len(parts) > 1:
+            when = when.replace(tzinfo=datetime.strptime(parts[1], '%z').tzinfo)
+        else:
+            when = when.replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return int(when.timestamp())
+
+
+def _brief(programme):
+    if programme is None:
+        return None
+    return {'title': programme['title'], 'start': programme['start'], 'stop': programme['stop']}
+
+
+def _isoformat(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
@@ -0,0 +1,218 @@
+import logging
+import re
+import threading
+import time
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Playlists are a few KB; anything much larger is not an HLS playlist.
+_MAX_PLAYLIST_BYTES = 1024 * 1024
+_URI_ATTR = re.compile(r'URI="([^"]*)"')
+# Tags whose URI attribute names another playlist rather than a segment or key.
+_PLAYLIST_TAGS = ('#EXT-X-MEDIA:', '#EXT-X-I-FRAME-STREAM-INF:')
+
+
+class RelayError(Exception):
+    """The upstream playlist could not be fetched and no usable copy is cached."""
+
+
+class HlsRelay:
+    """Fetches each channel's HLS playlists once per refresh window for all viewers.
+
+    A media playlist is cached for its ``#EXT-X-TARGETDURATION`` (the interval
+    at which players re-poll it), a master playlist for ``master_ttl``. Only
+    one request per playlist goes upstream at a time; while it is in flight,
+    other viewers get the previous copy, and if the upstream fails that copy
+    keeps being served, but only up to ``max_stale`` seconds past expiry.
+    Past that, viewers wait for the upstream request instead.
+
+    Segment, key and init-section URIs are made absolute so players fetch
+    them straight from the origin. Variant and rendition playlists are
+    rewritten to ``variant_uri(channel_id, source_id, index)`` and relayed
+    too. They are looked up by index in the cached master, so the relay only
+    ever fetches URLs listed by a catalog source.
+    """
+
+    def __init__(self, variant_uri, timeout=5, default_ttl=6, master_ttl=60, max_stale=30,
+                 pool_size=20, headers=None):
+        self.variant_uri = variant_uri
+        self.timeout = timeout
+        self.default_ttl = default_ttl
+        self.master_ttl = master_ttl
+        self.max_stale = max_stale
+        self.pool_size = pool_size
+        self.headers = dict(headers or {})
+        self._entries = {}
+        self._locks = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._session = None
+
+    def master(self, channel_id, source):
+        """Return (body, max_age) for the source's top-level playlist."""
+        return self._get(channel_id, source['id'], None, source['url'])
+
+    def variant(self, channel_id, source, index):
+        """Return (body, max_age) for a playlist listed in the master, or None if there is no such entry."""
+        master = self._entries.get((channel_id, source['id'], None))
+        if master is None or master.expires_at + self.max_stale < time.monotonic():
+            self.master(channel_id, source)
+            master = self._entries.get((channel_id, source['id'], None))
+        if master is None or not 0 <= index < len(master.playlists):
+            return None
+        return self._get(channel_id, source['id'], index, master.playlists[index])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'playlists': len(self._entries),
+                'channels': {channel_id: dict(counters) for channel_id, counters in self._counters.items()},
+            }
+
+    def _get(self, channel_id, source_id, index, url):
+        key = (channel_id, source_id, index)
+        self._count(channel_id, 'requests')
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self._count(channel_id, 'hits')
+            return entry.body, entry.max_age()
+
+        lock = self._key_lock(key)
+        usable = entry is not None and entry.expires_at + self.max_stale > time.monotonic()
+        if usable and not lock.acquire(blocking=False):
+            # Another request is refreshing this playlist; don't pile onto the origin.
+            self._count(channel_id, 'stale')
+            return entry.body, 1
+        if not usable:
+            # Nothing recent enough to serve; wait for the refresh in flight (at most ``timeout``).
+            lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > time.monotonic():
+                self._count(channel_id, 'hits')
+                return entry.body, entry.max_age()
+            try:
+                entry = self._fetch(channel_id, source_id, index, url)
+            except (requests.RequestException, ValueError) as e:
+                self._count(channel_id, 'errors')
+                logging.warning("HLS relay fetch for %s failed: %s", key, e)
+                if entry is not None and entry.expires_at + self.max_stale > time.monotonic():
+                    self._count(channel_id, 'stale')
+                    return entry.body, 1
+                raise RelayError(str(e)) from e
+            self._entries[key] = entry
+            return entry.body, entry.max_age()
+        finally:
+            lock.release()
+
+    def _fetch(self, channel_id, source_id, index, url):
+        started = time.monotonic()
+        with self._get_session().get(url, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            body = b''
+            for chunk in response.iter_content(16384):
+                body += chunk
+                if len(body) > _MAX_PLAYLIST_BYTES:
+                    raise ValueError("playlist too large")
+            # Relative URIs resolve against the final URL after redirects.
+            base_url = response.url
+        text = body.decode('utf-8', 'replace')
+        if not text.lstrip('\ufeff').startswith('#EXTM3U'):
+            raise ValueError("not an HLS playlist")
+        variant_uri = None
+        if index is None:
+            variant_uri = lambda i: self.variant_uri(channel_id, source_id, i)  # noqa: E731
+        text, target_duration, playlists = rewrite_playlist(text, base_url, variant_uri)
+        if playlists:
+            ttl = self.master_ttl
+        else:
+            ttl = target_duration or self.default_ttl
+        self._count(channel_id, 'fetches')
+        with self._lock:
+            self._counters[channel_id]['last_fetch_ms'] = int((time.monotonic() - started) * 1000)
+        return _Playlist(text.encode('utf-8'), ttl, playlists)
+
+    def _count(self, channel_id, name):
+        with self._lock:
+            counters = self._counters.get(channel_id)
+            if counters is None:
+                counters = self._counters[channel_id] = {
+                    'requests': 0, 'hits': 0, 'fetches': 0, 'stale': 0, 'errors': 0, 'last_fetch_ms': None,
+                }
+            counters[name] += 1
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _get_session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+        return self._session
+
+
+class _Playlist:
+    __slots__ = ('body', 'expires_at', 'playlists')
+
+    def __init__(self, body, ttl, playlists):
+        self.body = body
+        self.expires_at = time.monotonic() + ttl
+        self.playlists = playlists
+
+    def max_age(self):
+        return max(int(self.expires_at - time.monotonic()), 1)
+
+
+def rewrite_playlist(text, base_url, variant_uri=None):
+    """Make a playlist's URIs absolute against ``base_url``.
+
+    With ``variant_uri``, URIs of other playlists (variants and renditions)
+    are replaced by ``variant_uri(index)`` instead. Returns (text,
+    target_duration, upstream playlist URLs in index order).
+    """
+    playlists = []
+
+    def playlist_ref(uri):
+        absolute = urljoin(base_url, uri)
+        if variant_uri is None:
+            return absolute
+        playlists.append(absolute)
+        return variant_uri(len(playlists) - 1)
+
+    lines = []
+    target_duration = None
+    next_is_playlist = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            lines.append(line)
+        elif stripped.startswith('#'):
+            if stripped.startswith('#EXT-X-TARGETDURATION:'):
+                try:
+                    target_duration = float(stripped.split(':', 1)[1])
+                except ValueError:
+                    pass
+            elif stripped.startswith('#EXT-X-STREAM-INF:'):
+                next_is_playlist = True
+            if 'URI="' in stripped:
+                resolve = playlist_ref if stripped.startswith(_PLAYLIST_TAGS) else (lambda uri: urljoin(base_url, uri))
+                stripped = _URI_ATTR.sub(lambda m: f'URI="{resolve(m.group(1))}"', stripped)
+            lines.append(stripped)
+        elif next_is_playlist:
+            lines.append(playlist_ref(stripped))
+            next_is_playlist = False
+        else:
+            lines.append(urljoin(base_url, stripped))
+    return '\n'.join(lines) + '\n', target_duration, playlists
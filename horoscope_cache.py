@@ -0,0 +1,347 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Only refresh an entry's LRU timestamp when it is older than this, so cache
+# hits rarely turn into writes.
+_TOUCH_INTERVAL = 60
+# How often a worker waiting on another worker's lease re-checks the cache.
+_LEASE_POLL_INTERVAL = 0.25
+
+
+class HoroscopeCache:
+    """Horoscope results shared by all workers through a SQLite file.
+
+    Entries are addressed by (kind, subject, period), e.g. ('sign', 'leo',
+    '2025-01-31'), expire after a per-kind TTL, and survive restarts. When the
+    store grows past ``max_entries`` or ``max_bytes`` the least recently used
+    entries are evicted.
+
+    ``get_or_create()`` coalesces concurrent misses: within a process, threads
+    asking for the same key wait for the first one's result; across workers, a
+    lease row in the same database lets one worker generate while the others
+    poll the cache for the value it stores.
+    """
+
+    def __init__(self, path, ttls=None, default_ttl=86400, max_entries=5000, max_bytes=50 * 1024 * 1024,
+                 lease_ttl=90, error_ttl=60, max_stale=7 * 86400):
+        self.path = path
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lease_ttl = lease_ttl
+        self.error_ttl = error_ttl
+        self.max_stale = max_stale
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.generated = 0
+        self.stale_served = 0
+        self.negative_hits = 0
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind, subject, period):
+        return f"{kind}:{subject}:{period}"
+
+    def get(self, kind, subject, period):
+        """Return the cached value, or None on a miss (or if the store is unavailable)."""
+        key = self.make_key(kind, subject, period)
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value, accessed_at FROM horoscope_cache WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is not None and now - row['accessed_at'] > _TOUCH_INTERVAL:
+                    conn.execute("UPDATE horoscope_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            logging.exception("Horoscope cache read failed")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row['value'])
+
+    def set(self, kind, subject, period, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttls.get(kind, self.default_ttl)
+        key = self.make_key(kind, subject, period)
+        payload = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO horoscope_cache "
+                    "(key, kind, subject, period, value, size, created_at, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, kind, subject, period, payload, len(payload.encode('utf-8')), now, now + ttl, now),
+                )
+                self._evict(conn)
+        except sqlite3.Error:
+            logging.exception("Horoscope cache write failed")
+
+    def get_or_create(self, kind, subject, period, creator, ttl=None, allow_stale=False):
+        """Return the cached value, calling ``creator()`` at most once per key across workers.
+
+        Results carrying an ``'error'`` key are shared with concurrent waiters
+        and remembered for ``error_ttl`` seconds so a failing upstream is not
+        retried on every request.
+
+        With ``allow_stale``, a miss is answered with the newest good entry for
+        (kind, subject) from the last ``max_stale`` seconds, marked with
+        ``stale: True``, while the value is regenerated in the background.
+        """
+        if allow_stale:
+            value = self.get_or_stale(kind, subject, period, creator, ttl)
+        else:
+            value = self.get(kind, subject, period)
+        if value is not None:
+            return value
+        key = self.make_key(kind, subject, period)
+        error = self._get_error(key)
+        if error is not None:
+            return error
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self.coalesced += 1
+            flight.done.wait()
+            return flight.value
+        return self._run_flight(flight, kind, subject, period, key, creator, ttl)
+
+    def get_or_stale(self, kind, subject, period, creator, ttl=None):
+        """Return the cached value or, failing that, the newest stale one; None on a true miss.
+
+        Serving a stale value starts ``creator()`` in the background (unless
+        the key recently failed) so the next request gets a fresh one.
+        """
+        value = self.get(kind, subject, period)
+        if value is not None:
+            return value
+        stale = self._get_stale(kind, subject)
+        if stale is None:
+            return None
+        self.stale_served += 1
+        key = self.make_key(kind, subject, period)
+        if self._get_error(key) is None:
+            self._refresh_in_background(kind, subject, period, key, creator, ttl)
+        return stale
+
+    def _refresh_in_background(self, kind, subject, period, key, creator, ttl):
+        with self._flights_lock:
+            if key in self._flights:
+                return
+            flight = self._flights[key] = _Flight()
+        threading.Thread(
+            target=self._run_flight, args=(flight, kind, subject, period, key, creator, ttl),
+            name='horoscope-refresh', daemon=True,
+        ).start()
+
+    def _run_flight(self, flight, kind, subject, period, key, creator, ttl):
+        try:
+            flight.value = self._create(kind, subject, period, key, creator, ttl)
+        except Exception:
+            logging.exception("Generating %s failed", key)
+            flight.value = {'error': 'Could not retrieve horoscope data.'}
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    def _create(self, kind, subject, period, key, creator, ttl):
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + self.lease_ttl
+        while not self._acquire_lease(key, owner):
+            if time.monotonic() >= deadline:
+                logging.warning("Gave up waiting for the lease on %s; generating it here.", key)
+                break
+            time.sleep(_LEASE_POLL_INTERVAL)
+            value = self.get(kind, subject, period) or self._get_error(key)
+            if value is not None:
+                self.coalesced += 1
+                return value
+        try:
+            # Another worker may have finished between our miss and the lease.
+            value = self.get(kind, subject, period)
+            if value is not None:
+                self.coalesced += 1
+                return value
+            self.generated += 1
+            value = creator()
+            if isinstance(value, dict) and 'error' in value:
+                self._set_error(key, value)
+            else:
+                self.set(kind, subject, period, value, ttl)
+            return value
+        finally:
+            self._release_lease(key, owner)
+
+    def _get_stale(self, kind, subject):
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value, period FROM horoscope_cache WHERE kind = ? AND subject = ? AND created_at > ? "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (kind, subject, time.time() - self.max_stale),
+                ).fetchone()
+        except sqlite3.Error:
+            logging.exception("Horoscope cache read failed")
+            return None
+        if row is None:
+            return None
+        value = json.loads(row['value'])
+        if isinstance(value, dict):
+            value.update(stale=True, stale_period=row['period'])
+        return value
+
+    def _get_error(self, key):
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value FROM horoscope_errors WHERE key = ? AND expires_at > ?", (key, time.time()),
+                ).fetchone()
+        except sqlite3.Error:
+            logging.exception("Horoscope cache read failed")
+            return None
+        if row is None:
+            return None
+        self.negative_hits += 1
+        return json.loads(row['value'])
+
+    def _set_error(self, key, value):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM horoscope_errors WHERE expires_at <= ?", (now,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO horoscope_errors (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now + self.error_ttl),
+                )
+        except sqlite3.Error:
+            logging.exception("Horoscope cache write failed")
+
+    def _acquire_lease(self, key, owner):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM horoscope_leases WHERE key = ? AND expires_at <= ?", (key, now))
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO horoscope_leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                    (key, owner, now + self.lease_ttl),
+                )
+                return cursor.rowcount == 1
+        except sqlite3.Error:
+            logging.exception("Could not take horoscope cache lease for %s", key)
+            return True
+
+    def _release_lease(self, key, owner):
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM horoscope_leases WHERE key = ? AND owner = ?", (key, owner))
+        except sqlite3.Error:
+            logging.exception("Could not release horoscope cache lease for %s", key)
+
+    def stats(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM horoscope_cache").fetchone()
+        return {
+            'entries': row['entries'],
+            'bytes': row['bytes'],
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'generated': self.generated,
+            'coalesced': self.coalesced,
+            'stale_served': self.stale_served,
+            'negative_hits': self.negative_hits,
+        }
+
+    def _evict(self, conn):
+        row = conn.execute("SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM horoscope_cache").fetchone()
+        entries, size = row['entries'], row['bytes']
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+        # Expired entries go first, then the least recently used ones.
+        evicted = conn.execute("DELETE FROM horoscope_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        entries -= evicted
+        while entries > self.max_entries or size > self.max_bytes:
+            victims = conn.execute(
+                "SELECT key, size FROM horoscope_cache ORDER BY accessed_at LIMIT ?",
+                (max(entries - self.max_entries, 1),),
+            ).fetchall()
+            if not victims:
+                break
+            conn.executemany("DELETE FROM horoscope_cache WHERE key = ?", [(v['key'],) for v in victims])
+            evicted += len(victims)
+            entries -= len(victims)
+            size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM horoscope_cache").fetchone()[0]
+        self.evictions += evicted
+        logging.info("Evicted %d horoscope cache entries.", evicted)
+
+    @contextmanager
+    def _connect(self):
+        """Yield a connection that commits on success and is always closed."""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.row_factory = sqlite3.Row
+            if not self._initialized:
+                self._initialize(conn)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _initialize(self, conn):
+        with self._init_lock:
+            if self._initialized:
+                return
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS horoscope_cache ("
+                    " key TEXT PRIMARY KEY, kind TEXT NOT NULL, subject TEXT NOT NULL, period TEXT NOT NULL,"
+                    " value TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL,"
+                    " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_horoscope_cache_subject "
+                    "ON horoscope_cache (kind, subject, created_at)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_horoscope_cache_accessed ON horoscope_cache (accessed_at)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS horoscope_leases ("
+                    " key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS horoscope_errors ("
+                    " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+            self._initialized = True
+
+
+class _Flight:
+    """A generation in progress that other threads of this process can wait on."""
+
+    __slots__ = ('done', 'value')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
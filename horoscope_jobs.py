@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# How often a long-poll re-reads the job row.
+_POLL_INTERVAL = 0.25
+
+# The job being run by the current executor thread, for report_partial().
+_current = threading.local()
+
+
+class JobQueue:
+    """Runs slow horoscope generations off the request thread.
+
+    ``submit()`` records a job in a SQLite file shared by all workers and
+    hands the work to this process's thread pool, so the request that started
+    it returns at once and any worker can answer status polls. A pending or
+    running job for the same key is reused instead of starting another one.
+    Jobs older than ``timeout`` that never finished (e.g. their worker was
+    restarted) are reported as failed; finished jobs are kept for
+    ``retention`` seconds.
+
+    While a job runs, code it calls can publish finished parts of the result
+    with ``report_partial()``; status polls return them as ``partial``.
+    """
+
+    def __init__(self, path, max_workers=4, timeout=180, retention=3600):
+        self.path = path
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retention = retention
+        self.submitted = 0
+        self.reused = 0
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def submit(self, key, func):
+        """Queue ``func()`` for ``key`` and return the job as a dict."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM horoscope_jobs WHERE key = ? AND status IN ('pending', 'running') "
+                "AND created_at > ? ORDER BY created_at DESC LIMIT 1",
+                (key, now - self.timeout),
+            ).fetchone()
+            if row is not None:
+                self.reused += 1
+                return self._job(row)
+            job_id = uuid.uuid4().hex
+            conn.execute("DELETE FROM horoscope_jobs WHERE updated_at < ?", (now - self.retention,))
+            conn.execute(
+                "INSERT INTO horoscope_jobs (id, key, status, result, created_at, updated_at) "
+                "VALUES (?, ?, 'pending', NULL, ?, ?)",
+                (job_id, key, now, now),
+            )
+        self.submitted += 1
+        self._get_executor().submit(self._run, job_id, func)
+        return {'job_id': job_id, 'status': 'pending'}
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM horoscope_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def wait(self, job_id, timeout=0):
+        """Return the job once it has finished or ``timeout`` seconds have passed."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in ('done', 'error') or time.monotonic() >= deadline:
+                return job
+            time.sleep(_POLL_INTERVAL)
+
+    def report_partial(self, key, value):
+        """Record one finished top-level field of the running job's result (no-op outside a job)."""
+        job_id = getattr(_current, 'job_id', None)
+        if job_id is None:
+            return
+        _current.partial[key] = value
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE horoscope_jobs SET partial = ?, updated_at = ? WHERE id = ?",
+                    (json.dumps(_current.partial, ensure_ascii=False), time.time(), job_id),
+                )
+        except sqlite3.Error:
+            logging.exception("Could not update horoscope job %s", job_id)
+
+    def stats(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM horoscope_jobs GROUP BY status").fetchall()
+        return {
+            'jobs': {row['status']: row['n'] for row in rows},
+            'submitted': self.submitted,
+            'reused': self.reused,
+        }
+
+    def _run(self, job_id, func):
+        self._update(job_id, 'running', None)
+        _current.job_id, _current.partial = job_id, {}
+        try:
+            result = func()
+        except Exception:
+            logging.exception("Horoscope job %s failed", job_id)
+            result = {'error': 'Could not retrieve horoscope data.'}
+        finally:
+            _current.job_id = None
+        failed = not isinstance(result, dict) or 'error' in result
+        self._update(job_id, 'error' if failed else 'done', result)
+
+    def _update(self, job_id, status, result):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE horoscope_jobs SET status = ?, result = ?, updated_at = ? WHERE id = ?",
+                    (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                     time.time(), job_id),
+                )
+        except sqlite3.Error:
+            logging.exception("Could not update horoscope job %s", job_id)
+
+    def _job(self, row):
+        job = {'job_id': row['id'], 'status': row['status']}
+        if row['status'] in ('pending', 'running') and time.time() - row['created_at'] > self.timeout:
+            job['status'] = 'error'
+            job['result'] = {'error': 'Horoscope generation timed out.'}
+        elif row['result'] is not None:
+            job['result'] = json.loads(row['result'])
+        elif row['partial'] is not None:
+            job['partial'] = json.loads(row['partial'])
+        return job
+
+    def _get_executor(self):
+        pid = os.getpid()
+        if self._executor_pid != pid:
+            with self._lock:
+                if self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix='horoscope-job',
+                    )
+                    self._executor_pid = pid
+        return self._executor
+
+    @contextmanager
+    def _connect(self):
+        """Yield a connection that commits on success and is always closed."""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.row_factory = sqlite3.Row
+            if not self._initialized:
+                self._initialize(conn)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _initialize(self, conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS horoscope_jobs ("
+                " id TEXT PRIMARY KEY, key TEXT NOT NULL, status TEXT NOT NULL, result TEXT, partial TEXT,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_horoscope_jobs_key ON horoscope_jobs (key, status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_horoscope_jobs_updated ON horoscope_jobs (updated_at)")
+            # Job files created before partial results were reported.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(horoscope_jobs)")}
+            if 'partial' not in columns:
+                conn.execute("ALTER TABLE horoscope_jobs ADD COLUMN partial TEXT")
+        self._initialized = True
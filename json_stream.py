@@ -0,0 +1,77 @@
+import json
+
+
+class JsonObjectScanner:
+    """Finds the first top-level JSON object in text that arrives in chunks.
+
+    The brace/string state survives between ``feed()`` calls, so each
+    character is looked at once however the text is split. Every top-level
+    member is parsed as soon as the comma or closing brace after it arrives;
+    ``feed()`` returns the (key, value) pairs completed by that chunk. Text
+    before the opening brace (markdown fences, chatter) is ignored.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.complete = False
+        self._text = ''
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    @property
+    def started(self):
+        return bool(self._text)
+
+    @property
+    def text(self):
+        """The object text scanned so far (the whole object once ``complete``)."""
+        return self._text
+
+    def feed(self, chunk):
+        if self.complete or not chunk:
+            return []
+        if not self._text:
+            start = chunk.find('{')
+            if start == -1:
+                return []
+            chunk = chunk[start:]
+        base = len(self._text)
+        self._text += chunk
+        members = []
+        for offset, char in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self.depth += 1
+                if self.depth == 1:
+                    self._member_start = base + offset + 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    members.extend(self._member(base + offset))
+                    self._text = self._text[:base + offset + 1]
+                    self.complete = True
+                    break
+            elif char == ',' and self.depth == 1:
+                members.extend(self._member(base + offset))
+                self._member_start = base + offset + 1
+        return members
+
+    def _member(self, end):
+        member = self._text[self._member_start:end].strip()
+        if not member:
+            return []
+        try:
+            return list(json.loads('{' + member + '}').items())
+        except json.JSONDecodeError:
+            return []
@@ -0,0 +1,235 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Upstream statuses worth retrying; everything else is returned to the caller.
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class OpenRouterUnavailable(requests.RequestException):
+    """The call was not attempted or abandoned before getting a usable response."""
+
+
+class CircuitOpen(OpenRouterUnavailable):
+    pass
+
+
+class DeadlineExceeded(OpenRouterUnavailable):
+    pass
+
+
+class Deadline:
+    """Time budget shared by every attempt that serves one logical request."""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+
+class CircuitBreaker:
+    """Fails fast after ``threshold`` consecutive upstream failures.
+
+    Once open, calls are rejected for ``reset_timeout`` seconds; then a single
+    trial call is let through, and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.threshold:
+                if self.opened_at is None or self._trial_in_flight:
+                    logging.warning("OpenRouter circuit opened after %d failures.", self.failures)
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class OpenRouterClient:
+    """Chat-completions client with a pooled keep-alive session.
+
+    Every logical request runs under a ``Deadline``. Timeouts, connection
+    errors, 429 and 5xx responses are retried with exponential backoff and full
+    jitter (honouring ``Retry-After``) while the budget lasts, and repeated
+    upstream failures trip a ``CircuitBreaker``. Each HTTP attempt is recorded
+    for ``stats()``.
+    """
+
+    def __init__(self, api_url, api_key, headers=None, pool_size=10, deadline=60, attempt_timeout=35,
+                 connect_timeout=5, max_retries=3, backoff_base=1.0, backoff_max=8.0, breaker=None):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.headers = dict(headers or {})
+        self.pool_size = pool_size
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.attempts = 0
+        self.outcomes = {}
+        self._latencies = deque(maxlen=200)
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    def budget(self, seconds=None):
+        return Deadline(self.deadline if seconds is None else seconds)
+
+    def post(self, payload, budget=None, timeout=None, stream=False):
+        """POST ``payload`` and return the final response.
+
+        Non-retryable statuses (and the last retryable one) are returned as-is
+        so the caller can inspect them; raises ``CircuitOpen`` or
+        ``DeadlineExceeded`` when no attempt can be made in time. With
+        ``stream`` the body is left unread (see ``iter_stream_deltas()``) and
+        the recorded latency is the time to the response headers.
+        """
+        budget = budget or self.budget()
+        timeout = timeout or self.attempt_timeout
+        for attempt in range(self.max_retries + 1):
+            remaining = budget.remaining()
+            if remaining < 1:
+                raise DeadlineExceeded("OpenRouter deadline exceeded")
+            if not self.breaker.allow():
+                self._record('circuit_open', 0.0)
+                raise CircuitOpen("OpenRouter circuit is open")
+
+            started = time.monotonic()
+            try:
+                response = self._get_session().post(
+                    self.api_url, json=payload, timeout=(self.connect_timeout, min(timeout, remaining)),
+                    stream=stream,
+                )
+            except requests.RequestException as e:
+                self._record('timeout' if isinstance(e, requests.Timeout) else 'connection_error', started)
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+                self._backoff(attempt, budget, None)
+                continue
+
+            self._record(str(response.status_code), started)
+            # A 429 means the upstream is up but throttling us; only 5xx count against the circuit.
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if response.status_code not in _RETRY_STATUSES:
+                return response
+            if attempt == self.max_retries or not self._backoff(attempt, budget, response):
+                return response
+            response.close()
+        return response
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            'attempts': self.attempts,
+            'outcomes': dict(self.outcomes),
+            'latency_ms_p50': _percentile(latencies, 0.5),
+            'latency_ms_p95': _percentile(latencies, 0.95),
+            'circuit': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+        }
+
+    def _backoff(self, attempt, budget, response):
+        """Sleep before the next attempt; returns False if the budget cannot cover it."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        if delay >= budget.remaining() - 1:
+            return False
+        logging.info("Retrying OpenRouter call in %.1fs (attempt %d)", delay, attempt + 2)
+        time.sleep(delay)
+        return True
+
+    def _record(self, outcome, started):
+        latency_ms = int((time.monotonic() - started) * 1000) if started else 0
+        with self._lock:
+            self.attempts += 1
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            if started:
+                self._latencies.append(latency_ms)
+        logging.info("OpenRouter attempt: %s in %d ms", outcome, latency_ms)
+
+    def _get_session(self):
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers.update(self.headers)
+                    if self.api_key:
+                        session.headers['Authorization'] = f'Bearer {self.api_key}'
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+
+def iter_stream_deltas(response):
+    """Yield (content, finish_reason) for each chunk of a ``stream: true`` completion."""
+    response.encoding = 'utf-8'
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        # Blank lines separate events; lines starting with ':' are keep-alive comments.
+        if not line or not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            return
+        chunk = json.loads(data)
+        if chunk.get('error'):
+            raise requests.RequestException(f"OpenRouter stream error: {chunk['error']}")
+        choices = chunk.get('choices') or [{}]
+        yield (choices[0].get('delta') or {}).get('content') or '', choices[0].get('finish_reason')
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(int(len(values) * fraction), len(values) - 1)]
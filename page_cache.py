@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, render_template, request
+from jinja2 import meta
+from markupsafe import Markup
+
+
+class FragmentCache:
+    """Caches rendered template partials that only depend on site content.
+
+    A fragment is re-rendered when the content version returned by
+    ``version_func`` changes or when the template, or any template it
+    includes, is modified on disk. Only the latest rendering of each
+    template is kept.
+    """
+
+    def __init__(self, app, version_func):
+        self.app = app
+        self.version_func = version_func
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._includes = {}
+        self._filenames = {}
+        self._lock = threading.Lock()
+
+    def render(self, template_name):
+        key = (self.version_func(), self.template_signature(template_name))
+        entry = self._entries.get(template_name)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        html = Markup(render_template(template_name))
+        with self._lock:
+            self._entries[template_name] = (key, html)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        logging.info("Fragment cache cleared.")
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def template_signature(self, template_name):
+        """(name, mtime) of the template and every template it includes, recursively."""
+        signature = []
+        pending = [template_name]
+        seen = set()
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            filename = self._filename(name)
+            try:
+                mtime = os.stat(filename).st_mtime_ns
+            except OSError:
+                mtime = None
+            signature.append((name, mtime))
+            pending.extend(self._direct_includes(name, filename, mtime))
+        return tuple(sorted(signature, key=lambda item: item[0]))
+
+    def _filename(self, template_name):
+        filename = self._filenames.get(template_name)
+        if filename is None:
+            env = self.app.jinja_env
+            _, filename, _ = env.loader.get_source(env, template_name)
+            self._filenames[template_name] = filename
+        return filename
+
+    def _direct_includes(self, template_name, filename, mtime):
+        cached = self._includes.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        env = self.app.jinja_env
+        source, _, _ = env.loader.get_source(env, template_name)
+        names = tuple(name for name in meta.find_referenced_templates(env.parse(source)) if name)
+        self._includes[filename] = (mtime, names)
+        return names
+
+
+class _CachedPage:
+    __slots__ = ('body', 'mimetype', 'etag', 'last_modified', 'expires_at')
+
+    def __init__(self, body, mimetype, ttl):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.last_modified = time.time()
+        self.expires_at = time.monotonic() + ttl
+
+
+class ResponseCache:
+    """Full-page cache for anonymous GET requests, with ETag/Last-Modified validators.
+
+    Pages are keyed on (endpoint, host, view args, selected query args, content
+    version). Hits are served from stored bytes, and conditional requests are
+    answered with 304 without calling the view. Requests that carry a session
+    cookie (admin users, flashed messages) always bypass the cache, as does
+    debug mode.
+    """
+
+    def __init__(self, max_entries=512, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, version=None, vary=(), max_age=60, ttl=None):
+        """Decorate a view whose output only depends on its arguments and ``version()``.
+
+        ``ttl`` overrides how long a stored page may be served (default ``self.ttl``).
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self._cacheable_request():
+                    return view(*args, **kwargs)
+                key = (
+                    request.endpoint,
+                    request.host,
+                    tuple(sorted(request.view_args.items())) if request.view_args else (),
+                    tuple(request.args.get(name, '') for name in vary),
+                    version() if version else '',
+                )
+                entry = self._get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return self._respond(entry, max_age)
+                self.misses += 1
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                entry = _CachedPage(response.get_data(), response.mimetype, ttl or self.ttl)
+                self._put(key, entry)
+                return self._respond(entry, max_age)
+            return wrapper
+        return decorator
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _cacheable_request(self):
+        if current_app.debug or request.method not in ('GET', 'HEAD'):
+            return False
+        return current_app.config['SESSION_COOKIE_NAME'] not in request.cookies
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _respond(entry, max_age):
+        response = Response(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        response.last_modified = entry.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response.make_conditional(request)
+
+
+response_cache = ResponseCache()
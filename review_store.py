@@ -0,0 +1,346 @@
+import codecs
+import itertools
+import json
+import logging
+import time
+from datetime import datetime
+
+import pymysql
+
+from connect_db import db as dbutil
+
+MAX_TAG_LENGTH = 64
+
+
+def parse_tags(value):
+    """Normalise tags given as a list or a comma separated string into a unique list."""
+    if isinstance(value, (list, tuple)):
+        parts = value
+    elif isinstance(value, str):
+        parts = value.split(',')
+    else:
+        return []
+    tags = []
+    for part in parts:
+        tag = str(part).strip()[:MAX_TAG_LENGTH]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def set_review_tags(cur, slug, tags):
+    """Replace the review_tags rows of the review ``slug`` inside an open transaction."""
+    cur.execute(
+        "DELETE FROM review_tags WHERE review_id = (SELECT id FROM movie_reviews WHERE slug=%s)",
+        (slug,),
+    )
+    if tags:
+        cur.executemany(
+            "INSERT IGNORE INTO review_tags (review_id, tag) SELECT id, %s FROM movie_reviews WHERE slug=%s",
+            [(tag, slug) for tag in tags],
+        )
+
+
+def backfill_review_tags(batch_size=500):
+    """Populate review_tags from the comma separated movie_reviews.tags column.
+
+    Idempotent; walks the table in id order so it can run on large catalogs.
+    Returns the number of reviews processed.
+    """
+    last_id = 0
+    processed = 0
+    while True:
+        rows = dbutil.sql_fetchall_params(
+            "SELECT id, tags FROM movie_reviews WHERE id > %s AND tags IS NOT NULL ORDER BY id LIMIT %s",
+            (last_id, batch_size),
+        )
+        if not rows:
+            break
+        pairs = [(row['id'], tag) for row in rows for tag in parse_tags(row.get('tags'))]
+        if pairs:
+            with dbutil.transaction() as cur:
+                cur.executemany("INSERT IGNORE INTO review_tags (review_id, tag) VALUES (%s, %s)", pairs)
+        last_id = rows[-1]['id']
+        processed += len(rows)
+    logging.info("Backfilled review_tags for %d reviews.", processed)
+    return processed
+
+
+def tag_cloud(limit=50):
+    """Return [{'tag': ..., 'count': ...}] for the most used tags."""
+    rows = dbutil.sql_fetchall_params(
+        "SELECT tag, COUNT(*) AS c FROM review_tags GROUP BY tag ORDER BY c DESC, tag LIMIT %s",
+        (limit,),
+    )
+    return [{'tag': row['tag'], 'count': row['c']} for row in rows or []]
+
+
+MIN_SEARCH_LENGTH = 2
+# After the FULLTEXT query fails (no ngram index, no window functions), use LIKE for this long.
+FULLTEXT_RETRY_INTERVAL = 600
+_SEARCH_COLUMNS = "id, title, slug, excerpt, cover_image, rating, published_at, tags"
+_MATCH_ALL = "MATCH(title, excerpt, tags, body) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+_MATCH_TITLE = "MATCH(title) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+_fulltext_failed_at = None
+
+
+def search_reviews(query, limit=20, offset=0, match_slug=False):
+    """Full-text search over title, excerpt, tags and body, best matches first.
+
+    Backed by the ngram FULLTEXT indexes so Thai text (which has no word
+    separators) is searchable; title hits are weighted above body hits. The
+    total match count comes from a window function in the same query, so the
+    table is not scanned a second time. With ``match_slug`` (admin search),
+    reviews whose slug contains the query match too.
+
+    Servers without the indexes or window functions (older MySQL, MariaDB)
+    fail that query; the search then falls back to LIKE, newest first.
+    Returns (rows, total).
+    """
+    global _fulltext_failed_at
+    query = (query or '').strip()
+    if len(query) < MIN_SEARCH_LENGTH:
+        return [], 0
+    if _fulltext_failed_at is None or time.monotonic() - _fulltext_failed_at > FULLTEXT_RETRY_INTERVAL:
+        where = f"({_MATCH_ALL} OR slug LIKE %s)" if match_slug else _MATCH_ALL
+        params = (query, query, query) + ((_like_pattern(query),) if match_slug else ()) + (limit, offset)
+        try:
+            # Run through transaction() so a failure raises instead of looking like no matches.
+            with dbutil.transaction() as cur:
+                cur.execute(
+                    f"SELECT {_SEARCH_COLUMNS}, {_MATCH_TITLE} * 2 + {_MATCH_ALL} AS score, COUNT(*) OVER () AS total "
+                    f"FROM movie_reviews WHERE {where} "
+                    "ORDER BY score DESC, published_at DESC, id DESC LIMIT %s OFFSET %s",
+                    params,
+                )
+                rows = cur.fetchall()
+        except Exception as e:
+            logging.exception("Full-text review search failed; using LIKE")
+            # Server-side errors (codes below 2000) mean the query itself is unsupported,
+            # e.g. 1191 no FULLTEXT index or 1064 no window functions; client errors are transient.
+            if isinstance(e, pymysql.MySQLError) and e.args and isinstance(e.args[0], int) and e.args[0] < 2000:
+                _fulltext_failed_at = time.monotonic()
+        else:
+            _fulltext_failed_at = None
+            return rows, rows[0]['total'] if rows else 0
+    return _like_search(query, limit, offset, match_slug)
+
+
+def _like_search(query, limit, offset, match_slug):
+    columns = ('title', 'excerpt', 'tags') + (('slug',) if match_slug else ())
+    where = ' OR '.join(f"{column} LIKE %s" for column in columns)
+    params = (_like_pattern(query),) * len(columns)
+    rows = dbutil.sql_fetchall_params(
+        f"SELECT {_SEARCH_COLUMNS} FROM movie_reviews WHERE {where} "
+        "ORDER BY published_at DESC, id DESC LIMIT %s OFFSET %s",
+        params + (limit, offset),
+    ) or []
+    total_row = dbutil.sql_fetchone_params(f"SELECT COUNT(*) AS c FROM movie_reviews WHERE {where}", params) or {'c': 0}
+    return rows, total_row.get('c', 0)
+
+
+def _like_pattern(query):
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+IMPORT_BATCH_SIZE = 500
+_INSERT_REVIEW_SQL = (
+    "INSERT IGNORE INTO movie_reviews (title, slug, excerpt, cover_image, rating, tags, body, published_at) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+)
+
+
+_NUMBER_CHARS = '0123456789+-.eE'
+
+
+def iter_json_array(fileobj, chunk_size=64 * 1024):
+    """Yield the elements of a top-level JSON array (or a single object) from a file.
+
+    Elements are decoded as soon as they are complete, so only one element and
+    one read chunk are held in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    in_array = None
+
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            eof = True
+        if isinstance(chunk, bytes):
+            chunk = text_decoder.decode(chunk, final=eof)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    while True:
+        skip_whitespace()
+        if pos >= len(buffer):
+            if in_array:
+                raise ValueError('unexpected end of JSON array')
+            return
+        if in_array is None:
+            in_array = buffer[pos] == '['
+            if in_array:
+                pos += 1
+                skip_whitespace()
+                if pos < len(buffer) and buffer[pos] == ']':
+                    return
+        elif in_array:
+            if buffer[pos] == ']':
+                return
+            if buffer[pos] != ',':
+                raise ValueError(f"expected ',' or ']' in JSON array, got {buffer[pos]!r}")
+            pos += 1
+            skip_whitespace()
+        else:
+            raise ValueError('unexpected data after JSON object')
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            # A number could continue in the next chunk ("7" of "7.5", or "7" parsed
+            # from "7." / "1e"); read on until something other than number characters follows.
+            if (not eof and not isinstance(item, (dict, list, str))
+                    and not buffer[end:].strip(_NUMBER_CHARS)):
+                fill()
+                continue
+            break
+        pos = end
+        yield item
+
+
+def validate_review_item(item):
+    """Return (params, None) for a valid import item or (None, reason) otherwise."""
+    if not isinstance(item, dict):
+        return None, 'not an object'
+    title = str(item.get('title') or '').strip()
+    slug = str(item.get('slug') or '').strip()
+    if not title or not slug:
+        return None, 'missing title or slug'
+    if len(title) > 255 or len(slug) > 255:
+        return None, 'title or slug too long'
+    try:
+        rating = float(item.get('rating', 0) or 0)
+    except (TypeError, ValueError):
+        return None, 'invalid rating'
+    if not 0 <= rating <= 10:
+        return None, 'rating out of range'
+    published_at = item.get('published_at') or None
+    if published_at is not None:
+        try:
+            published_at = datetime.strptime(str(published_at)[:10], '%Y-%m-%d').date()
+        except ValueError:
+            return None, 'invalid published_at'
+    tags = parse_tags(item.get('tags'))
+    params = (
+        title, slug, item.get('excerpt'), item.get('cover_image') or None, rating,
+        ','.join(tags) or None, json.dumps(item.get('body', []), ensure_ascii=False), published_at,
+    )
+    return (params, tags), None
+
+
+def _import_batch(rows):
+    """Insert one batch in a single transaction. Returns (inserted, skipped)."""
+    with dbutil.transaction() as cur:
+        slugs = [params[1] for params, _ in rows]
+        placeholders = ', '.join(['%s'] * len(slugs))
+        cur.execute(f"SELECT slug FROM movie_reviews WHERE slug IN ({placeholders})", slugs)
+        existing = {row['slug'] for row in cur.fetchall()}
+        new_rows = [(params, tags) for params, tags in rows if params[1] not in existing]
+        inserted = 0
+        if new_rows:
+            inserted = cur.executemany(_INSERT_REVIEW_SQL, [params for params, _ in new_rows]) or 0
+            tag_pairs = [(tag, params[1]) for params, tags in new_rows for tag in tags]
+            if tag_pairs:
+                cur.executemany(
+                    "INSERT IGNORE INTO review_tags (review_id, tag) SELECT id, %s FROM movie_reviews WHERE slug=%s",
+                    tag_pairs,
+                )
+    return inserted, len(rows) - inserted
+
+
+def bulk_import_reviews(items, batch_size=IMPORT_BATCH_SIZE):
+    """Validate and insert review items in batches, one transaction per batch.
+
+    Existing slugs (and duplicates within the upload) are skipped; invalid items
+    and batches whose transaction fails are counted as failed. If ``items``
+    raises ValueError (a JSON syntax error part-way through an upload), the
+    items decoded before it are still inserted and the rest of the upload is
+    abandoned; ``report['aborted']`` holds the error. Re-importing the fixed
+    file skips the rows already inserted. Returns a report with overall
+    totals, per-batch counts and timings, and sample errors.
+    """
+    report = {'inserted': 0, 'skipped': 0, 'failed': 0, 'batches': [], 'errors': [], 'aborted': None}
+    started = time.perf_counter()
+    seen_slugs = set()
+    pending = []
+
+    def record_error(position, reason, count=1):
+        report['failed'] += count
+        if len(report['errors']) < 20:
+            report['errors'].append({'index': position, 'error': reason})
+
+    def flush():
+        batch_started = time.perf_counter()
+        batch = {'batch': len(report['batches']) + 1, 'size': len(pending), 'inserted': 0, 'skipped': 0, 'failed': 0}
+        try:
+            batch['inserted'], batch['skipped'] = _import_batch(pending)
+        except Exception as e:
+            logging.exception("Review import batch %d failed", batch['batch'])
+            batch['failed'] = len(pending)
+            record_error(None, f"batch {batch['batch']}: {e}", len(pending))
+        batch['elapsed_ms'] = round((time.perf_counter() - batch_started) * 1000, 1)
+        report['inserted'] += batch['inserted']
+        report['skipped'] += batch['skipped']
+        report['batches'].append(batch)
+        pending.clear()
+
+    iterator = iter(items)
+    for index in itertools.count():
+        try:
+            item = next(iterator)
+        except StopIteration:
+            break
+        except ValueError as e:
+            # Earlier batches are committed; the complete items pending here are flushed below.
+            logging.warning("Review import stopped at item %d: %s", index, e)
+            report['aborted'] = str(e)
+            report['errors'].append({'index': index, 'error': f"invalid JSON, import stopped: {e}"})
+            break
+        row, reason = validate_review_item(item)
+        if row is None:
+            record_error(index, reason)
+            continue
+        slug = row[0][1]
+        if slug in seen_slugs:
+            report['skipped'] += 1
+            continue
+        seen_slugs.add(slug)
+        pending.append(row)
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logging.info("Imported reviews: %d inserted, %d skipped, %d failed in %.1f ms",
+                 report['inserted'], report['skipped'], report['failed'], report['elapsed_ms'])
+    return report
@@ -0,0 +1,78 @@
+import hashlib
+import threading
+from xml.sax.saxutils import escape
+
+# Sitemap protocol limit per file; larger sites must publish a sitemap index.
+MAX_URLS_PER_SITEMAP = 50000
+
+_XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+_NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def _format_lastmod(value):
+    if value is None:
+        return None
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+def iter_urlset(entries):
+    """Yield a <urlset> document chunk by chunk for (loc, lastmod) entries."""
+    yield f'{_XML_HEADER}<urlset xmlns="{_NAMESPACE}">\n'
+    for loc, lastmod in entries:
+        lastmod = _format_lastmod(lastmod)
+        if lastmod:
+            yield f'  <url>\n    <loc>{escape(loc)}</loc>\n    <lastmod>{lastmod}</lastmod>\n  </url>\n'
+        else:
+            yield f'  <url>\n    <loc>{escape(loc)}</loc>\n  </url>\n'
+    yield '</urlset>\n'
+
+
+def iter_sitemap_index(entries):
+    """Yield a <sitemapindex> document for (loc, lastmod) child sitemap entries."""
+    yield f'{_XML_HEADER}<sitemapindex xmlns="{_NAMESPACE}">\n'
+    for loc, lastmod in entries:
+        lastmod = _format_lastmod(lastmod)
+        yield f'  <sitemap>\n    <loc>{escape(loc)}</loc>\n'
+        if lastmod:
+            yield f'    <lastmod>{lastmod}</lastmod>\n'
+        yield '  </sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+class SitemapCache:
+    """Keeps fully generated sitemap documents for the current content version.
+
+    ``stream()`` passes chunks through to the client while recording them; the
+    document is stored only if generation runs to completion. Entries for an
+    older version are dropped as soon as a newer version is stored.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def get(self, version, name):
+        with self._lock:
+            if version != self._version:
+                return None
+            return self._documents.get(name)
+
+    def stream(self, version, name, chunks):
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        body = ''.join(parts).encode('utf-8')
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._documents = {}
+            self._documents[name] = (body, hashlib.sha1(body).hexdigest())
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._documents = {}
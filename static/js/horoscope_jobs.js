@@ -0,0 +1,37 @@
+/**
+ * TVHUB — Horoscope API helper
+ * Cold horoscopes are generated in a background job: the API answers 202 with
+ * a status_url, which is polled here until the job is done. Sections that are
+ * already generated come back as job.partial and are passed to onPartial.
+ */
+(function () {
+    var POLL_DELAYS = [250, 500, 500, 750, 1000];
+    var MAX_POLL_MS = 180000;
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    async function readJson(res) {
+        var data = await res.json();
+        if (!res.ok && res.status !== 202) throw new Error(data.error || 'เกิดข้อผิดพลาด');
+        if (data.error) throw new Error(data.error);
+        return data;
+    }
+
+    window.fetchHoroscope = async function (url, options, onPartial) {
+        var res = await fetch(url, options);
+        var data = await readJson(res);
+        if (res.status !== 202) return data;
+
+        var started = Date.now();
+        for (var attempt = 0; Date.now() - started < MAX_POLL_MS; attempt++) {
+            await sleep(POLL_DELAYS[Math.min(attempt, POLL_DELAYS.length - 1)]);
+            var job = await readJson(await fetch(data.status_url));
+            if (job.status === 'done') return job.result;
+            if (job.status === 'error') throw new Error((job.result && job.result.error) || 'เกิดข้อผิดพลาด');
+            if (job.partial && onPartial) onPartial(job.partial);
+        }
+        throw new Error('การทำนายใช้เวลานานเกินไป กรุณาลองใหม่อีกครั้ง');
+    };
+})();
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+import os
+import posixpath
+
+MANIFEST_NAME = '.export-manifest.json'
+
+
+def export_site(client, output_dir, pages, force=False):
+    """Render ``pages`` through ``client`` into ``output_dir`` as static files.
+
+    ``pages`` is a list of (path, inputs). ``inputs`` is anything with a
+    stable ``repr()`` describing what the page depends on. A page whose input
+    fingerprint matches the manifest from the last export is not rendered
+    again; pass ``inputs=None`` for pages that must always be rendered.
+    A rendered page is only written if its bytes changed, so unchanged files
+    keep their mtime for rsync and CDN purges. Files of pages that are no
+    longer exported are removed, and a page that fails to render keeps its
+    previous file.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    manifest = {}
+    report = {'rendered': 0, 'written': 0, 'skipped': 0, 'removed': 0, 'failed': []}
+    for path, inputs in pages:
+        filename = output_filename(path)
+        target = os.path.join(output_dir, filename)
+        fingerprint = _fingerprint(inputs) if inputs is not None else None
+        old = previous.get(path)
+        if (not force and fingerprint is not None and old and old['inputs'] == fingerprint
+                and os.path.exists(target)):
+            manifest[path] = old
+            report['skipped'] += 1
+            continue
+
+        report['rendered'] += 1
+        try:
+            response = client.get(path)
+            # Streamed pages (the sitemap) can still fail while the body is read.
+            body = response.get_data()
+        except Exception:
+            logging.exception("Static export of %s failed", path)
+            response = None
+        if response is None or response.status_code != 200:
+            if response is not None:
+                logging.error("Static export of %s failed with HTTP %d", path, response.status_code)
+            report['failed'].append(path)
+            if old:
+                manifest[path] = old
+            continue
+        digest = hashlib.sha1(body).hexdigest()
+        if force or not old or old['sha1'] != digest or not os.path.exists(target):
+            _write(target, body)
+            report['written'] += 1
+        manifest[path] = {'file': filename, 'inputs': fingerprint, 'sha1': digest}
+
+    for path, old in previous.items():
+        if path not in manifest:
+            target = os.path.join(output_dir, old['file'])
+            try:
+                os.remove(target)
+                report['removed'] += 1
+                # Drop directories left empty (live/<channel>/); stops at the first non-empty one.
+                os.removedirs(os.path.dirname(target))
+            except OSError:
+                pass
+
+    _write(manifest_path, json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    return report
+
+
+def output_filename(path):
+    """Map a URL path to the file nginx serves for it ("/live/ch3" -> "live/ch3/index.html")."""
+    path = path.lstrip('/')
+    if not path or path.endswith('/'):
+        return path + 'index.html'
+    if posixpath.splitext(path)[1]:
+        return path
+    return path + '/index.html'
+
+
+def _fingerprint(inputs):
+    return hashlib.sha1(repr(inputs).encode('utf-8')).hexdigest()
+
+
+def _write(target, body):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, target)
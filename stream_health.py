@@ -0,0 +1,322 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Playlists are a few KB; anything much larger is not an HLS playlist.
+_MAX_PLAYLIST_BYTES = 1024 * 1024
+# A live playlist whose newest segment is older than this many target
+# durations (and at least _MIN_STALE_SECONDS) is no longer being updated.
+_STALE_TARGET_DURATIONS = 3
+_MIN_STALE_SECONDS = 30
+
+
+class StreamHealth:
+    """Probes embed sources' HLS playlists and keeps the results in SQLite.
+
+    ``check()`` fetches every playlist concurrently on a bounded thread pool,
+    following a master playlist to its first variant, and records whether it
+    answered, its time to first byte and whether the live playlist is still
+    moving. Results are shared by all workers through the database; each
+    process re-reads them at most every ``reload_interval`` seconds.
+    Results older than ``max_age`` are ignored by ``for_channel()``.
+    """
+
+    def __init__(self, path, max_workers=8, timeout=5, max_age=1800, reload_interval=10, headers=None):
+        self.path = path
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_age = max_age
+        self.reload_interval = reload_interval
+        self.headers = dict(headers or {})
+        self.runs = 0
+        self.last_run = None
+        self._records = {}
+        self._version = ''
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def check(self, sources):
+        """Probe ``(channel_id, source)`` pairs and store the results; returns them as dicts."""
+        sources = list(sources)
+        if not sources:
+            return []
+        previous = self._load()
+        started = time.monotonic()
+        session = self._session()
+        with ThreadPoolExecutor(max_workers=max(self.max_workers, 1), thread_name_prefix='stream-health') as pool:
+            results = list(pool.map(
+                lambda item: self._probe(session, item[0], item[1], previous.get((item[0], item[1].get('id')))),
+                sources,
+            ))
+        session.close()
+        self._save(results)
+        self.runs += 1
+        self.last_run = {
+            'sources': len(results),
+            'healthy': sum(1 for r in results if r['ok']),
+            'elapsed_ms': int((time.monotonic() - started) * 1000),
+            'finished_at': time.time(),
+        }
+        logging.info("Checked %d stream sources: %d healthy in %d ms",
+                     len(results), self.last_run['healthy'], self.last_run['elapsed_ms'])
+        return results
+
+    def for_channel(self, channel_id):
+        """Return {source_id: result} for the channel's recent probe results."""
+        records = self._snapshot()
+        cutoff = time.time() - self.max_age
+        return {
+            source_id: record for (cid, source_id), record in records.items()
+            if cid == channel_id and record['checked_at'] > cutoff
+        }
+
+    @property
+    def version(self):
+        """Changes whenever the preferred order of any channel's sources changes."""
+        self._snapshot()
+        return self._version
+
+    def last_checked_at(self):
+        try:
+            with self._connect() as conn:
+                return conn.execute("SELECT MAX(checked_at) FROM stream_health").fetchone()[0]
+        except sqlite3.Error:
+            logging.exception("Stream health read failed")
+            return None
+
+    def stats(self):
+        records = self._snapshot()
+        return {
+            'sources': len(records),
+            'healthy': sum(1 for r in records.values() if r['ok']),
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'unhealthy': sorted(f"{cid}/{sid}: {r['error']}" for (cid, sid), r in records.items() if not r['ok']),
+        }
+
+    def _probe(self, session, channel_id, source, previous):
+        url = source.get('url')
+        result = {
+            'channel_id': channel_id, 'source_id': source.get('id'), 'url': url, 'ok': False,
+            'http_status': None, 'ttfb_ms': None, 'media_sequence': None, 'target_duration': None,
+            'fresh': None, 'error': None, 'checked_at': time.time(),
+        }
+        try:
+            status, ttfb_ms, playlist = self._fetch(session, url)
+            result['http_status'], result['ttfb_ms'] = status, ttfb_ms
+            if status != 200:
+                result['error'] = f"HTTP {status}"
+            elif playlist['variants']:
+                variant_url = urljoin(url, playlist['variants'][0])
+                status, _, playlist = self._fetch(session, variant_url)
+                if status != 200:
+                    result['error'] = f"variant HTTP {status}"
+            if result['error'] is None:
+                result.update(self._freshness(playlist, previous, result['checked_at']))
+                result['ok'] = result['fresh'] is not False
+        except (requests.RequestException, ValueError) as e:
+            result['error'] = _short_error(e)
+        if result['ok']:
+            result['error'] = None
+        return result
+
+    def _fetch(self, session, url):
+        with session.get(url, timeout=self.timeout, stream=True) as response:
+            # ``elapsed`` stops when the response headers have been parsed.
+            ttfb_ms = int(response.elapsed.total_seconds() * 1000)
+            if response.status_code != 200:
+                return response.status_code, ttfb_ms, None
+            body = b''
+            for chunk in response.iter_content(16384):
+                body += chunk
+                if len(body) > _MAX_PLAYLIST_BYTES:
+                    raise ValueError("playlist too large")
+        return 200, ttfb_ms, parse_playlist(body.decode('utf-8', 'replace'))
+
+    @staticmethod
+    def _freshness(playlist, previous, now):
+        """Decide whether a media playlist is a live stream that is still advancing."""
+        info = {'media_sequence': playlist['media_sequence'], 'target_duration': playlist['target_duration']}
+        if playlist['endlist']:
+            return {**info, 'fresh': False, 'error': 'playlist has ended'}
+        if not playlist['segments']:
+            return {**info, 'fresh': False, 'error': 'no segments'}
+        stale_after = max((playlist['target_duration'] or 10) * _STALE_TARGET_DURATIONS, _MIN_STALE_SECONDS)
+        if playlist['last_segment_end'] is not None:
+            age = now - playlist['last_segment_end']
+            if age > stale_after:
+                return {**info, 'fresh': False, 'error': f"newest segment is {int(age)}s old"}
+            return {**info, 'fresh': True}
+        # Without timestamps, a live playlist must have moved on since the last probe.
+        if (previous and previous['media_sequence'] is not None and playlist['media_sequence'] is not None
+                and now - previous['checked_at'] > stale_after):
+            if playlist['media_sequence'] <= previous['media_sequence']:
+                return {**info, 'fresh': False, 'error': 'media sequence is not advancing'}
+            return {**info, 'fresh': True}
+        return {**info, 'fresh': None}
+
+    def _session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def _snapshot(self):
+        now = time.monotonic()
+        if now - self._loaded_at >= self.reload_interval:
+            with self._lock:
+                if now - self._loaded_at >= self.reload_interval:
+                    self._records = self._load()
+                    self._version = _ranking_version(self._records, time.time() - self.max_age)
+                    self._loaded_at = now
+        return self._records
+
+    def _load(self):
+        try:
+            with self._connect() as conn:
+                rows = conn.execute("SELECT * FROM stream_health").fetchall()
+        except sqlite3.Error:
+            logging.exception("Stream health read failed")
+            return self._records
+        return {
+            (row['channel_id'], row['source_id']): {**dict(row), 'ok': bool(row['ok']),
+                                                    'fresh': None if row['fresh'] is None else bool(row['fresh'])}
+            for row in rows
+        }
+
+    def _save(self, results):
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO stream_health (channel_id, source_id, url, ok, http_status, ttfb_ms,"
+                    " media_sequence, target_duration, fresh, error, checked_at)"
+                    " VALUES (:channel_id, :source_id, :url, :ok, :http_status, :ttfb_ms, :media_sequence,"
+                    " :target_duration, :fresh, :error, :checked_at)",
+                    results,
+                )
+        except sqlite3.Error:
+            logging.exception("Stream health write failed")
+            return
+        self._loaded_at = 0.0
+
+    @contextmanager
+    def _connect(self):
+        """Yield a connection that commits on success and is always closed."""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.row_factory = sqlite3.Row
+            if not self._initialized:
+                self._initialize(conn)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _initialize(self, conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stream_health ("
+                " channel_id TEXT NOT NULL, source_id TEXT NOT NULL, url TEXT, ok INTEGER NOT NULL,"
+                " http_status INTEGER, ttfb_ms INTEGER, media_sequence INTEGER, target_duration REAL,"
+                " fresh INTEGER, error TEXT, checked_at REAL NOT NULL,"
+                " PRIMARY KEY (channel_id, source_id))"
+            )
+        self._initialized = True
+
+
+def parse_playlist(text):
+    """Extract what the health check needs from an HLS playlist; raises ValueError if it is not one."""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or not lines[0].startswith('#EXTM3U'):
+        raise ValueError("not an HLS playlist")
+    playlist = {
+        'variants': [], 'segments': 0, 'target_duration': None, 'media_sequence': None,
+        'endlist': False, 'last_segment_end': None,
+    }
+    expect_variant = False
+    segment_duration = 0.0
+    program_time = None
+    for line in lines[1:]:
+        if line.startswith('#EXT-X-STREAM-INF'):
+            expect_variant = True
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            playlist['target_duration'] = float(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            playlist['media_sequence'] = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-ENDLIST'):
+            playlist['endlist'] = True
+        elif line.startswith('#EXT-X-PROGRAM-DATE-TIME:'):
+            program_time = _parse_program_time(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            segment_duration = float(line[8:].split(',', 1)[0] or 0)
+        elif line.startswith('#'):
+            continue
+        elif expect_variant:
+            playlist['variants'].append(line)
+            expect_variant = False
+        else:
+            playlist['segments'] += 1
+            if program_time is not None:
+                playlist['last_segment_end'] = program_time + segment_duration
+                # The tag dates only the segment right after it; later ones follow on.
+                program_time += segment_duration
+    return playlist
+
+
+def rank_sources(sources, health):
+    """Order embed sources best first: healthy by time to first byte, then unchecked, then failing.
+
+    Unchecked and failing sources keep the primary-first catalog order.
+    """
+    def key(item):
+        index, source = item
+        record = health.get(source.get('id'))
+        fallback = (not source.get('is_primary'), index)
+        if record is None:
+            return (1, 0, fallback)
+        if record['ok']:
+            return (0, record['ttfb_ms'] or 0, fallback)
+        return (2, 0, fallback)
+    return [source for _, source in sorted(enumerate(sources), key=key)]
+
+
+def _ranking_version(records, cutoff):
+    ranking = {}
+    for (channel_id, source_id), record in sorted(records.items()):
+        if record['checked_at'] > cutoff:
+            ranking.setdefault(channel_id, []).append((source_id, record['ok']))
+    for channel_id, entries in ranking.items():
+        healthy = {sid for sid, ok in entries if ok}
+        fastest = min(
+            (records[(channel_id, sid)] for sid in healthy), key=lambda r: r['ttfb_ms'] or 0, default=None,
+        )
+        ranking[channel_id] = (sorted(healthy), fastest['source_id'] if fastest else None)
+    return hashlib.sha1(repr(sorted(ranking.items())).encode('utf-8')).hexdigest()[:12]
+
+
+def _parse_program_time(value):
+    try:
+        return datetime.fromisoformat(value.strip().replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _short_error(error):
+    if isinstance(error, requests.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.ConnectionError):
+        return 'connection error'
+    return str(error)[:200]
@@ -0,0 +1,90 @@
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def media_playlist(sequence=100, target_duration=6, segment_age=0, program_time=True, ended=False):
+    """An HLS media playlist with two segments, the newest ending ``segment_age`` seconds ago."""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{target_duration}',
+             f'#EXT-X-MEDIA-SEQUENCE:{sequence}']
+    if program_time:
+        start = time.time() - segment_age - 2 * target_duration
+        lines.append(f'#EXT-X-PROGRAM-DATE-TIME:{datetime.fromtimestamp(start, timezone.utc).isoformat()}')
+    for n in range(2):
+        lines += [f'#EXTINF:{target_duration:.1f},', f'seg{sequence + n}.ts']
+    if ended:
+        lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+class FakeOrigin:
+    """A local HTTP server standing in for a stream origin.
+
+    ``routes`` maps a path to (status, body) or (status, body, delay);
+    unknown paths answer 404. ``hits`` counts requests per path.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.hits = {}
+        self._lock = threading.Lock()
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                with origin._lock:
+                    origin.hits[path] = origin.hits.get(path, 0) + 1
+                status, body, *rest = origin.routes.get(path, (404, ''))
+                if rest:
+                    time.sleep(rest[0])
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def url(self, path):
+        return self.base_url + path
+
+
+@pytest.fixture(scope='session')
+def flask_app(tmp_path_factory):
+    """The application module, with its SQLite state in a temporary DATA_DIR.
+
+    No MySQL server is needed; database calls fail and are logged.
+    """
+    os.environ['DATA_DIR'] = str(tmp_path_factory.mktemp('var'))
+    import app
+    app.app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.app.test_client()
+
+
+@pytest.fixture
+def origin():
+    server = FakeOrigin()
+    thread = threading.Thread(target=server.server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
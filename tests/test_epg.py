@@ -0,0 +1,97 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from epg import EpgGuide
+
+
+def _guide_xml(title='News'):
+    def stamp(when):
+        return when.strftime('%Y%m%d%H%M%S +0000')
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><tv>'
+        '<channel id="3HD.th"><display-name>Ch3</display-name></channel>'
+        f'<programme start="{stamp(now - timedelta(minutes=10))}" stop="{stamp(now + timedelta(minutes=20))}" '
+        f'channel="3HD.th"><title>{title}</title></programme>'
+        f'<programme start="{stamp(now + timedelta(minutes=20))}" stop="{stamp(now + timedelta(minutes=50))}" '
+        'channel="3HD.th"><title>Drama</title></programme>'
+        '</tv>'
+    )
+
+
+@pytest.fixture
+def feed():
+    """An XMLTV origin that honours If-None-Match; set ``feed.body`` and ``feed.etag``."""
+    class Feed:
+        body = _guide_xml()
+        etag = '"v1"'
+        conditional = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            Feed.conditional.append(self.headers.get('If-None-Match'))
+            if self.headers.get('If-None-Match') == Feed.etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            data = Feed.body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('ETag', Feed.etag)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    Feed.url = f'http://127.0.0.1:{server.server_port}/guide.xml'
+    yield Feed
+    server.shutdown()
+    server.server_close()
+
+
+def _epg(feed, tmp_path):
+    channels = {'ch3': {'name': 'Ch3', 'epg_id': '3HD.th'}}
+    return EpgGuide(feed.url, str(tmp_path / 'guide.xml'), lambda: channels, check_interval=0)
+
+
+def test_unchanged_feed_is_not_downloaded_again(feed, tmp_path):
+    guide = _epg(feed, tmp_path)
+    assert guide.refresh() == 'updated'
+    assert guide.refresh() == 'skipped'
+    assert guide.refresh(force=True) == 'not-modified'
+    assert feed.conditional == [None, '"v1"']
+
+    assert guide.load() == 2
+    current, upcoming = guide.now_next('ch3')
+    assert (current['title'], upcoming['title']) == ('News', 'Drama')
+
+
+def test_unparseable_feed_is_downloaded_again(feed, tmp_path):
+    feed.body = _guide_xml()[:120]
+    guide = _epg(feed, tmp_path)
+    assert guide.refresh() == 'updated'
+    assert guide.load() == 0 and guide.last_error
+
+    # The origin has not changed the ETag, but the bad copy must not be kept with a 304.
+    feed.body = _guide_xml('Fixed')
+    assert guide.refresh(force=True) == 'updated'
+    assert feed.conditional == [None, None]
+    assert guide.load() == 2
+    assert guide.now_next('ch3')[0]['title'] == 'Fixed'
+
+
+def test_changed_file_is_reloaded_in_background(feed, tmp_path):
+    guide = _epg(feed, tmp_path)
+    guide.refresh()
+    assert guide.now_next('ch3') == (None, None)
+    deadline = time.monotonic() + 5
+    while guide.reload_count == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert guide.now_next('ch3')[0]['title'] == 'News'
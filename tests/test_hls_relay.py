@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+from conftest import media_playlist
+from hls_relay import HlsRelay, RelayError, rewrite_playlist
+
+MASTER = (
+    '#EXTM3U\n'
+    '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="th",URI="audio/th.m3u8"\n'
+    '#EXT-X-STREAM-INF:BANDWIDTH=800000,AUDIO="aud"\n'
+    'low/index.m3u8\n'
+)
+
+
+def _relay(**kwargs):
+    return HlsRelay(lambda channel_id, source_id, index: f'/live/{channel_id}/variant/{index}.m3u8?source={source_id}',
+                    timeout=2, **kwargs)
+
+
+def test_viewers_share_one_origin_fetch_per_window(origin):
+    origin.routes['/live.m3u8'] = (200, media_playlist(target_duration=1), 0.2)
+    source = {'id': 'main', 'url': origin.url('/live.m3u8')}
+    relay = _relay()
+    bodies = []
+
+    def viewer():
+        bodies.append(relay.master('ch3', source)[0])
+    viewers = [threading.Thread(target=viewer) for _ in range(20)]
+    for thread in viewers:
+        thread.start()
+    for thread in viewers:
+        thread.join()
+
+    assert origin.hits['/live.m3u8'] == 1
+    assert len(set(bodies)) == 1 and len(bodies) == 20
+    counters = relay.stats()['channels']['ch3']
+    assert counters['requests'] == 20 and counters['fetches'] == 1 and counters['hits'] == 19
+
+    time.sleep(1.1)
+    relay.master('ch3', source)
+    assert origin.hits['/live.m3u8'] == 2
+
+
+def test_master_and_variants_are_rewritten(origin):
+    origin.routes['/ch/master.m3u8'] = (200, MASTER)
+    origin.routes['/ch/low/index.m3u8'] = (200, media_playlist(sequence=5))
+    source = {'id': 'main', 'url': origin.url('/ch/master.m3u8')}
+    relay = _relay()
+
+    master, max_age = relay.master('ch3', source)
+    assert master.decode().splitlines()[1:] == [
+        '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="th",URI="/live/ch3/variant/0.m3u8?source=main"',
+        '#EXT-X-STREAM-INF:BANDWIDTH=800000,AUDIO="aud"',
+        '/live/ch3/variant/1.m3u8?source=main',
+    ]
+    assert max_age > 1
+
+    variant, _ = relay.variant('ch3', source, 1)
+    assert origin.url('/ch/low/seg5.ts') in variant.decode().splitlines()
+    assert relay.variant('ch3', source, 2) is None
+    assert origin.hits['/ch/master.m3u8'] == 1
+
+
+def test_stale_copy_is_served_while_the_origin_is_down(origin):
+    origin.routes['/live.m3u8'] = (200, media_playlist(target_duration=1))
+    source = {'id': 'main', 'url': origin.url('/live.m3u8')}
+    relay = _relay(max_stale=1)
+    body, _ = relay.master('ch3', source)
+
+    origin.routes['/live.m3u8'] = (503, '')
+    time.sleep(1.1)
+    assert relay.master('ch3', source) == (body, 1)
+
+    time.sleep(1)
+    with pytest.raises(RelayError):
+        relay.master('ch3', source)
+    counters = relay.stats()['channels']['ch3']
+    assert counters['stale'] == 1 and counters['errors'] == 2
+
+
+def test_non_playlist_responses_are_rejected(origin):
+    origin.routes['/page.m3u8'] = (200, '<html>blocked</html>')
+    with pytest.raises(RelayError):
+        _relay().master('ch3', {'id': 'main', 'url': origin.url('/page.m3u8')})
+
+
+def test_rewrite_playlist_resolves_segment_and_key_uris():
+    text = '#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXT-X-KEY:METHOD=AES-128,URI="../key.bin"\n#EXTINF:4.0,\nseg1.ts\n'
+    rewritten, target_duration, playlists = rewrite_playlist(text, 'https://cdn.example/live/ch3/index.m3u8')
+    assert rewritten.splitlines()[2:] == [
+        '#EXT-X-KEY:METHOD=AES-128,URI="https://cdn.example/live/key.bin"',
+        '#EXTINF:4.0,',
+        'https://cdn.example/live/ch3/seg1.ts',
+    ]
+    assert target_duration == 4.0 and playlists == []
+
+
+def test_copy_past_max_stale_is_not_served_while_the_origin_hangs(origin):
+    origin.routes['/live.m3u8'] = (200, media_playlist(sequence=1, target_duration=1))
+    source = {'id': 'main', 'url': origin.url('/live.m3u8')}
+    relay = _relay(max_stale=0.5)
+    old, _ = relay.master('ch3', source)
+
+    origin.routes['/live.m3u8'] = (200, media_playlist(sequence=2, target_duration=1), 1.5)
+    time.sleep(1.1)
+    refresh = threading.Thread(target=relay.master, args=('ch3', source))
+    refresh.start()
+    time.sleep(0.1)
+    # Within max_stale: the copy is served while the refresh is in flight.
+    assert relay.master('ch3', source) == (old, 1)
+
+    time.sleep(0.5)
+    started = time.monotonic()
+    body, _ = relay.master('ch3', source)
+    refresh.join()
+    # Past max_stale: the viewer waited for the refresh instead of getting the old copy.
+    assert body != old and 'seg2.ts' in body.decode()
+    assert time.monotonic() - started > 0.3
+    assert origin.hits['/live.m3u8'] == 2
@@ -0,0 +1,47 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def pending_job(flask_app):
+    release = threading.Event()
+    job = flask_app.horoscope_jobs.submit(f'test:{time.monotonic()}', lambda: release.wait(30) and {})
+    yield job
+    release.set()
+
+
+@pytest.mark.parametrize('wait', ['nan', 'inf', '-inf', 'NaN'])
+def test_job_wait_must_be_finite(client, pending_job, wait):
+    started = time.monotonic()
+    response = client.get(f"/api/horoscope/jobs/{pending_job['job_id']}?wait={wait}")
+    assert response.status_code == 400
+    assert time.monotonic() - started < 1
+
+
+def test_job_wait_is_clamped(client, flask_app, pending_job, monkeypatch):
+    monkeypatch.setattr(flask_app, 'HOROSCOPE_JOB_MAX_WAIT', 0.3)
+    started = time.monotonic()
+    response = client.get(f"/api/horoscope/jobs/{pending_job['job_id']}?wait=1e9")
+    assert response.status_code == 200
+    assert response.get_json()['status'] in ('pending', 'running')
+    assert time.monotonic() - started < 2
+
+
+def test_unknown_job(client):
+    assert client.get('/api/horoscope/jobs/missing?wait=0').status_code == 404
+
+
+def test_birth_errors_are_400(client, flask_app, monkeypatch):
+    assert client.post('/api/horoscope/birth', json={'birthdate': '31/02/2535'}).status_code == 400
+
+    monkeypatch.setattr(flask_app.horoscope_cache, 'get_or_stale', lambda *args, **kwargs: None)
+    monkeypatch.setattr(flask_app.horoscope_jobs, 'submit', lambda key, func: {
+        'job_id': 'x', 'status': 'error', 'result': {'error': 'Could not retrieve horoscope data.'},
+    })
+    response = client.post('/api/horoscope/birth', json={'birthdate': '24/08/2535'})
+    assert response.status_code == 400 and response.get_json()['error']
+
+    monkeypatch.setattr(flask_app.horoscope_cache, 'get_or_stale', lambda *args, **kwargs: {'error': 'failed'})
+    assert client.post('/api/horoscope/birth', json={'birthdate': '24/08/2535'}).status_code == 400
@@ -0,0 +1,19 @@
+import sqlite3
+
+
+def test_store_errors_are_not_cached(client, flask_app, monkeypatch):
+    def broken(limit, window):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(flask_app.click_store, 'top', broken)
+    response = client.get('/api/popular?window=24h&limit=7')
+    assert response.status_code == 503
+    assert response.get_json()['channels'] == []
+
+    monkeypatch.setattr(flask_app.click_store, 'top', lambda limit, window: [{'name': 'ch3', 'clicks': 5}])
+    response = client.get('/api/popular?window=24h&limit=7')
+    assert response.status_code == 200
+    assert response.get_json()['channels'] == [{'name': 'ch3', 'clicks': 5}]
+
+
+def test_invalid_window(client):
+    assert client.get('/api/popular?window=1y').status_code == 400
@@ -0,0 +1,52 @@
+import io
+import json
+
+import pytest
+
+import review_store
+from review_store import bulk_import_reviews, iter_json_array
+
+
+def _item(n):
+    return {'title': f'Review {n}', 'slug': f'review-{n}', 'body': 'text', 'rating': 4, 'published_at': '2024-01-01'}
+
+
+@pytest.fixture
+def inserted(monkeypatch):
+    batches = []
+
+    def import_batch(rows):
+        batches.append([row[0][1] for row in rows])
+        return len(rows), 0
+    monkeypatch.setattr(review_store, '_import_batch', import_batch)
+    return batches
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64 * 1024])
+@pytest.mark.parametrize('document', ['[7.5]', '[1e3]', '[1, -2.5e-3, true, null, "x", {"a": 1.25}]', ' {"a": 2} ', '[]'])
+def test_iter_json_array_across_chunk_boundaries(document, chunk_size):
+    expected = json.loads(document)
+    expected = expected if isinstance(expected, list) else [expected]
+    assert list(iter_json_array(io.BytesIO(document.encode()), chunk_size)) == expected
+    assert list(iter_json_array(io.StringIO(document), chunk_size)) == expected
+
+
+def test_syntax_error_keeps_rows_decoded_before_it(inserted):
+    document = json.dumps([_item(n) for n in range(5)])[:-1] + ', {"title": broken]'
+
+    report = bulk_import_reviews(iter_json_array(io.BytesIO(document.encode()), 16), batch_size=2)
+
+    assert inserted == [['review-0', 'review-1'], ['review-2', 'review-3'], ['review-4']]
+    assert report['inserted'] == 5
+    assert report['aborted']
+    assert report['errors'][-1]['index'] == 5
+
+
+def test_invalid_items_are_reported(inserted):
+    items = [_item(0), {'title': 'no slug'}, _item(0), _item(1)]
+
+    report = bulk_import_reviews(items)
+
+    assert inserted == [['review-0', 'review-1']]
+    assert (report['inserted'], report['skipped'], report['failed'], report['aborted']) == (2, 1, 1, None)
+    assert report['errors'][0]['index'] == 1
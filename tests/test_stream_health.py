@@ -0,0 +1,90 @@
+import time
+
+from conftest import media_playlist
+from stream_health import StreamHealth, parse_playlist, rank_sources
+
+
+def _health(tmp_path, **kwargs):
+    kwargs.setdefault('timeout', 2)
+    return StreamHealth(str(tmp_path / 'stream_health.sqlite3'), reload_interval=0, **kwargs)
+
+
+def test_fastest_healthy_source_ranks_first(origin, tmp_path):
+    origin.routes['/slow.m3u8'] = (200, media_playlist(), 0.3)
+    origin.routes['/fast/master.m3u8'] = (200, '#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nlow/index.m3u8\n')
+    origin.routes['/fast/low/index.m3u8'] = (200, media_playlist())
+    sources = [
+        {'id': 'slow', 'url': origin.url('/slow.m3u8'), 'is_primary': True},
+        {'id': 'dead', 'url': origin.url('/missing.m3u8')},
+        {'id': 'fast', 'url': origin.url('/fast/master.m3u8')},
+    ]
+    health = _health(tmp_path)
+
+    results = {r['source_id']: r for r in health.check(('ch3', s) for s in sources)}
+
+    assert results['fast']['ok'] and results['fast']['fresh'] is True
+    assert origin.hits['/fast/low/index.m3u8'] == 1
+    assert results['slow']['ok'] and results['slow']['ttfb_ms'] >= 300
+    assert not results['dead']['ok'] and results['dead']['error'] == 'HTTP 404'
+    ranked = rank_sources(sources, health.for_channel('ch3'))
+    assert [s['id'] for s in ranked] == ['fast', 'slow', 'dead']
+
+
+def test_dead_streams_are_unhealthy(origin, tmp_path):
+    origin.routes['/ended.m3u8'] = (200, media_playlist(ended=True))
+    origin.routes['/stale.m3u8'] = (200, media_playlist(segment_age=600))
+    origin.routes['/html.m3u8'] = (200, '<html></html>')
+    sources = [{'id': name, 'url': origin.url(f'/{name}.m3u8')} for name in ('ended', 'stale', 'html')]
+
+    results = {r['source_id']: r for r in _health(tmp_path).check(('ch3', s) for s in sources)}
+
+    assert results['ended']['error'] == 'playlist has ended'
+    assert results['stale']['error'].startswith('newest segment is')
+    assert results['html']['error'] == 'not an HLS playlist'
+    assert not any(r['ok'] for r in results.values())
+
+
+def test_sources_are_probed_concurrently(origin, tmp_path):
+    sources = []
+    for n in range(4):
+        origin.routes[f'/s{n}.m3u8'] = (200, media_playlist(), 0.5)
+        sources.append(('ch3', {'id': f's{n}', 'url': origin.url(f'/s{n}.m3u8')}))
+
+    started = time.monotonic()
+    results = _health(tmp_path, max_workers=4).check(sources)
+
+    assert all(r['ok'] for r in results)
+    assert time.monotonic() - started < 1.5
+
+
+def test_results_are_shared_through_the_database(origin, tmp_path):
+    origin.routes['/a.m3u8'] = (200, media_playlist())
+    writer = _health(tmp_path)
+    reader = _health(tmp_path)
+    version = reader.version
+
+    writer.check([('ch3', {'id': 'a', 'url': origin.url('/a.m3u8')})])
+
+    assert reader.for_channel('ch3')['a']['ok']
+    assert reader.version != version
+
+
+def test_sequence_must_advance_without_program_date_time(origin, tmp_path):
+    source = ('ch3', {'id': 'a', 'url': origin.url('/a.m3u8')})
+    origin.routes['/a.m3u8'] = (200, media_playlist(sequence=100, program_time=False))
+    health = _health(tmp_path)
+    first = health.check([source])[0]
+    assert first['ok'] and first['fresh'] is None
+
+    # Pretend the last probe was long ago; the playlist has not moved since.
+    health._save([dict(first, checked_at=first['checked_at'] - 120)])
+    second = health.check([source])[0]
+    assert second['error'] == 'media sequence is not advancing'
+
+
+def test_parse_playlist_reads_master_and_media():
+    master = parse_playlist('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\nlow.m3u8\n')
+    assert master['variants'] == ['low.m3u8'] and master['segments'] == 0
+
+    media = parse_playlist(media_playlist(sequence=7, target_duration=4, ended=True))
+    assert (media['media_sequence'], media['target_duration'], media['segments'], media['endlist']) == (7, 4.0, 2, True)